@@ -3,8 +3,9 @@ from assessment.models import Survey, Question, Choice, SurveyImage
 from django.contrib.auth.models import User
 from django.forms import TextInput, Textarea
 from django.db import models
+from django.contrib import messages
 
-from copy import deepcopy
+from assessment.cloning import CloneError, clone_surveys
 
 
 class ChoiceInline(admin.TabularInline):
@@ -36,23 +37,13 @@ class SurveyAdmin(admin.ModelAdmin):
     actions = ['duplicate']
 
     def duplicate(self, request, queryset):
-        for obj in queryset:
-            obj_copy = deepcopy(obj)
-            obj_copy.id = None
-            obj_copy.save()
-
-            for question in obj.question_set.all():
-                question_copy = deepcopy(question)
-                question_copy.id = None
-                question_copy.save()
-                obj_copy.question_set.add(question_copy)
-
-                for choice in question.choice_set.all():
-                    choice_copy = deepcopy(choice)
-                    choice_copy.id = None
-                    choice_copy.save()
-                    question_copy.choice_set.add(choice_copy)
-            obj_copy.save()
+        surveys = list(queryset)
+        try:
+            copies = clone_surveys([(survey, '%s (copy)' % survey.name) for survey in surveys])
+        except CloneError as e:
+            self.message_user(request, str(e), level=messages.ERROR)
+            return
+        self.message_user(request, 'Duplicated %s surveys.' % len(copies))
 
 admin.site.unregister(User)
 admin.site.register(Survey, SurveyAdmin)
@@ -0,0 +1,139 @@
+"""
+Timed sittings of a survey.
+
+An Attempt is created on the candidate's first view of a survey and holds the
+start time and, for timed surveys, the deadline, so the remaining time is one
+subtraction.  Submitting the survey finishes the attempt (see
+ResultCreateForm.save); attempts left open past their deadline are finalized
+in bulk by finalize_expired, run periodically by the sweep_attempts command.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from assessment.models import Attempt, Result, Answer
+from assessment import survey_stats
+from assessment.dashboard import invalidate_dashboards
+from assessment.drafts import get_drafts, discard_drafts, draft_form_data
+from assessment.survey_cache import get_compiled_survey
+from assessment.survey_forms import ResultCreateForm
+
+
+ATTEMPT_GRACE_SECONDS = getattr(settings, 'ASSESSMENT_ATTEMPT_GRACE_SECONDS', 300)
+BATCH_SIZE = 500
+
+
+def deadline_for(survey, started_on):
+    if survey.minutes_allowed > 0:
+        return started_on + datetime.timedelta(minutes=survey.minutes_allowed)
+    return None
+
+
+def start_attempt(user, survey, session=None):
+    """
+    The user's attempt at a (compiled) survey, created on first call.  A start
+    time left in the session by earlier versions is carried over once.
+    """
+    try:
+        return Attempt.objects.get(user_id=user.id, survey_id=survey.id)
+    except Attempt.DoesNotExist:
+        pass
+    started_on = None
+    if session is not None and survey.slug in session:
+        try:
+            started_on = datetime.datetime.strptime(session.pop(survey.slug), "%Y-%m-%d %H:%M:%S.%f")
+        except (TypeError, ValueError):
+            pass
+    started_on = started_on or datetime.datetime.now()
+    try:
+        with transaction.atomic():
+            return Attempt.objects.create(user_id=user.id, survey_id=survey.id, started_on=started_on,
+                                          deadline=deadline_for(survey, started_on))
+    except IntegrityError:
+        # a concurrent request created it first.
+        return Attempt.objects.get(user_id=user.id, survey_id=survey.id)
+
+
+def expired_attempts(now=None, grace=ATTEMPT_GRACE_SECONDS):
+    now = now or datetime.datetime.now()
+    return Attempt.objects.filter(finished_on__isnull=True,
+                                  deadline__lt=now - datetime.timedelta(seconds=grace))
+
+
+def insert_results(results, batch_size):
+    """
+    Insert results and return those inserted.  A candidate may submit after
+    the sweeper checked for a result, so when the bulk insert breaks the
+    unique (survey, user) constraint each result is retried under its own
+    savepoint and the ones already submitted are skipped.
+    """
+    try:
+        with transaction.atomic():
+            Result.objects.bulk_create(results, batch_size=batch_size)
+        return results
+    except IntegrityError:
+        pass
+    inserted = []
+    for result in results:
+        try:
+            with transaction.atomic():
+                Result.objects.bulk_create([result])
+        except IntegrityError:
+            continue
+        inserted.append(result)
+    return inserted
+
+
+def finalize_expired(now=None, grace=ATTEMPT_GRACE_SECONDS, batch_size=BATCH_SIZE):
+    """
+    Submit the saved draft of every open attempt past its deadline plus grace
+    seconds, scoring whatever answers validate.  Each batch costs a fixed
+    number of queries.  Returns the number of attempts finalized.
+    """
+    now = now or datetime.datetime.now()
+    finalized = 0
+    while True:
+        attempts = list(expired_attempts(now, grace).select_related('user').order_by('deadline', 'id')[:batch_size])
+        if not attempts:
+            return finalized
+        pairs = [(attempt.user_id, attempt.survey_id) for attempt in attempts]
+        submitted = set(Result.objects.filter(user_id__in=set(pair[0] for pair in pairs),
+                                              survey_id__in=set(pair[1] for pair in pairs)).values_list(
+            'user_id', 'survey_id'))
+        drafts = get_drafts(pairs)
+        surveys = {}
+        results = []
+        answers = {}
+        for attempt, pair in zip(attempts, pairs):
+            if pair in submitted:
+                continue
+            if attempt.survey_id not in surveys:
+                surveys[attempt.survey_id] = get_compiled_survey(attempt.survey_id)
+            form = ResultCreateForm(surveys[attempt.survey_id], attempt.user, attempt.started_on,
+                                    data=draft_form_data(drafts[pair]))
+            form.is_valid()
+            result, answers[pair] = form.build_result(now=attempt.deadline)
+            results.append(result)
+        with transaction.atomic():
+            results = insert_results(results, batch_size)
+            if results:
+                # bulk_create does not return primary keys
+                result_ids = dict(((user_id, survey_id), result_id) for result_id, user_id, survey_id in
+                                  Result.objects.filter(user_id__in=set(result.user_id for result in results),
+                                                        survey_id__in=set(surveys)).values_list(
+                                      'id', 'user_id', 'survey_id'))
+                new_answers = []
+                for result in results:
+                    pair = (result.user_id, result.survey_id)
+                    for answer in answers[pair]:
+                        answer.result_id = result_ids[pair]
+                        new_answers.append(answer)
+                Answer.objects.bulk_create(new_answers, batch_size=batch_size)
+            Attempt.objects.filter(id__in=[attempt.id for attempt in attempts]).update(finished_on=now)
+        discard_drafts(pairs)
+        # bulk_create sends no post_save, so drop the score aggregates here.
+        for survey_id in surveys:
+            survey_stats.invalidate(survey_id)
+        invalidate_dashboards(result.user_id for result in results)
+        finalized += len(results)
@@ -1,22 +1,61 @@
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+
+
+USER_CACHE_TIMEOUT = getattr(settings, 'ASSESSMENT_USER_CACHE_TIMEOUT', 60 * 60)
+
+USER_KEY = 'assessment:user:%s'
+EMAIL_KEY = 'assessment:user-email:%s'
+USERNAME_KEY = 'assessment:user-username:%s'
+
+
+def get_cached_user(user_id):
+    """
+    Return the User with user_id from the cache, loading it on a miss, or
+    None.  Entries are dropped whenever the user is saved or deleted.
+    """
+    user = cache.get(USER_KEY % user_id)
+    if user is None:
+        try:
+            user = User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        cache.set(USER_KEY % user_id, user, USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_user(user):
+    cache.delete_many([USER_KEY % user.pk, EMAIL_KEY % user.email.lower(), USERNAME_KEY % user.username])
 
 
 class EmailOrUsernameModelBackend(object):
     def authenticate(self, username=None, password=None):
+        if username is None:
+            return None
         if '@' in username:
-            kwargs = {'email': username}
+            key = EMAIL_KEY % username.lower()
+            kwargs = {'email__iexact': username}
         else:
+            key = USERNAME_KEY % username
             kwargs = {'username': username}
-        try:
-            user = User.objects.get(**kwargs)
-            if user.check_password(password):
-                return user
-        except User.DoesNotExist:
-            return None
+        user = None
+        user_id = cache.get(key)
+        if user_id is not None:
+            user = get_cached_user(user_id)
+            # the e-mail address or username may have changed since
+            if user is not None and user.username != username and user.email.lower() != username.lower():
+                user = None
+        if user is None:
+            try:
+                user = User.objects.get(**kwargs)
+            except (User.DoesNotExist, User.MultipleObjectsReturned):
+                return None
+            cache.set(key, user.pk, USER_CACHE_TIMEOUT)
+            cache.set(USER_KEY % user.pk, user, USER_CACHE_TIMEOUT)
+        if user.check_password(password):
+            return user
+        return None
 
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
+        return get_cached_user(user_id)
@@ -0,0 +1,238 @@
+"""
+Benchmarks of every view, result submission and survey duplication.
+
+generate_data fills the database with N users, M surveys of K questions and
+R results using bulk inserts.  run_benchmarks then times every URL in
+urls.py through the test client, plus ResultCreateForm.save and the
+SurveyAdmin.duplicate action, recording the SQL query count of each.  Each
+benchmark runs `repeat` times: the first run is reported as cold (empty
+caches after generate_data), the rest as warm.  Records are plain dicts so
+the benchmark command can write them as JSON and runs can be diffed.
+"""
+import datetime
+import random
+import time
+from uuid import uuid4
+
+from django.contrib.admin.sites import site
+from django.contrib.auth.hashers import make_password
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from assessment import survey_cache
+from assessment.models import User, UserProfile, Survey, Available, Result, Answer
+from assessment.survey_forms import ResultCreateForm
+from assessment.survey_io import import_survey
+from assessment.tokens import make_login_token
+
+
+PASSWORD = 'benchmark'
+BATCH_SIZE = 500
+
+
+class BenchmarkData(object):
+    """
+    Handles on the generated rows the benchmarks need.
+    """
+
+    def __init__(self, size, staff, candidate, surveys, open_survey, result_id):
+        self.size = size
+        self.staff = staff
+        self.candidate = candidate
+        self.surveys = surveys
+        self.open_survey = open_survey
+        self.result_id = result_id
+
+
+def size_label(users, surveys, questions, results):
+    return 'u%s-s%s-q%s-r%s' % (users, surveys, questions, results)
+
+
+def create_user(username, is_staff=False, password=None):
+    user = User.objects.create(username=username, email=username, is_staff=is_staff, is_superuser=is_staff,
+                               password=password or make_password(PASSWORD))
+    return user
+
+
+def generate_data(users, surveys, questions, results, choices=5, seed=0):
+    """
+    Create the benchmark data set and return its BenchmarkData.  The first
+    user is the candidate the candidate views run as; the last survey is left
+    unanswered by that user.
+    """
+    rng = random.Random(seed)
+    definition_choices = [{'choice_value': 'Choice %s' % j, 'weight': j} for j in range(choices)]
+    created_surveys = [import_survey({
+        'name': 'Benchmark survey %s' % i,
+        'description': 'Benchmark survey %s' % i,
+        'choices': definition_choices,
+        'questions': [{'question': 'Question %s' % k, 'question_name': 'Q%s' % k, 'question_type': 2,
+                       'page_number': 1} for k in range(questions)],
+    }) for i in range(surveys)]
+    staff = create_user('staff@benchmark.test', is_staff=True)
+
+    password = make_password(PASSWORD)
+    usernames = ['user%s@benchmark.test' % i for i in range(users)]
+    with transaction.atomic():
+        User.objects.bulk_create([User(username=username, email=username, password=password,
+                                       first_name='First %s' % i, last_name='Last %s' % i)
+                                  for i, username in enumerate(usernames)], batch_size=BATCH_SIZE)
+        # bulk_create does not return primary keys
+        user_ids = list(User.objects.filter(username__in=usernames).order_by('id').values_list('id', flat=True))
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id, profile_token=str(uuid4()))
+                                         for user_id in user_ids], batch_size=BATCH_SIZE)
+        Available.objects.bulk_create([Available(user_id=user_id, survey_id=survey.id, url='')
+                                       for user_id in user_ids for survey in created_surveys],
+                                      batch_size=BATCH_SIZE)
+
+        pairs = [(user_id, survey) for survey in created_surveys for user_id in user_ids]
+        if pairs and user_ids:
+            pairs.remove((user_ids[0], created_surveys[-1]))
+        pairs = pairs[:results]
+        now = datetime.datetime.now()
+        new_results = []
+        picks = {}
+        for user_id, survey in pairs:
+            compiled = survey_cache.get_compiled_survey(survey.id)
+            picked = [rng.choice(question.choices) for question in compiled.questions if question.choices]
+            picks[(user_id, survey.id)] = (compiled, picked)
+            total_score = compiled.score([choice.id for choice in picked])
+            new_results.append(Result(user_id=user_id, survey_id=survey.id, started_on=now, excess_seconds=0,
+                                      score='%s' % total_score, total_score=total_score))
+        Result.objects.bulk_create(new_results, batch_size=BATCH_SIZE)
+        result_ids = dict(((user_id, survey_id), result_id) for result_id, user_id, survey_id in
+                          Result.objects.filter(survey_id__in=[survey.id for survey in created_surveys]).values_list(
+                              'id', 'user_id', 'survey_id'))
+        Answer.objects.bulk_create([Answer(result_id=result_ids[pair], question_id=question.id,
+                                           answer=choice.choice_value, choice_ids=str(choice.id))
+                                    for pair, (compiled, picked) in picks.items()
+                                    for question, choice in zip(compiled.questions, picked)],
+                                   batch_size=BATCH_SIZE)
+    candidate = User.objects.get(pk=user_ids[0]) if user_ids else create_user('candidate@benchmark.test')
+    return BenchmarkData(size_label(users, surveys, questions, results), staff, candidate, created_surveys,
+                         created_surveys[-1] if created_surveys else None,
+                         min(result_ids.values()) if result_ids else None)
+
+
+def measure(name, run, setup=None, repeat=3):
+    """
+    Time run(*setup()) repeat times and return its benchmark record.
+    """
+    samples = []
+    for i in range(repeat):
+        args = setup() if setup else ()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            status = run(*args)
+            elapsed = time.time() - start
+        samples.append((elapsed, len(queries), status))
+    warm = samples[1:] or samples
+    return {
+        'name': name,
+        'status': samples[-1][2],
+        'cold_seconds': round(samples[0][0], 6),
+        'cold_queries': samples[0][1],
+        'seconds': round(min(sample[0] for sample in warm), 6),
+        'queries': warm[-1][1],
+    }
+
+
+def url_benchmarks(data):
+    """
+    (url name, user, method, args callable, post data) for every URL.
+    Mutating URLs get a fresh target from their args callable on each run.
+    """
+    survey = data.open_survey
+    slug_args = lambda: (survey.slug,)
+    throwaway = lambda: (create_user('%s@benchmark.test' % uuid4().hex).id,)
+    return [
+        ('assessment_index', 'staff', 'get', lambda: (), None),
+        ('assessment_login', None, 'get', lambda: (), None),
+        ('assessment_landpage', 'candidate', 'get', lambda: (), None),
+        ('assessment_logout', 'candidate', 'get', lambda: (), None),
+        ('assessment_registration', 'staff', 'get', lambda: (), None),
+        ('assessment_users', 'staff', 'get', lambda: (), None),
+        ('assessment_import', 'staff', 'get', lambda: (), None),
+        ('assessment_results', 'staff', 'get', lambda: (data.candidate.id,), None),
+        ('assessment_deleteuser', 'staff', 'get', throwaway, None),
+        ('assessment_revoketokens', 'staff', 'post', throwaway, {}),
+        ('assessment_surveys', 'candidate', 'get', lambda: (), None),
+        ('assessment_survey', 'candidate', 'get', slug_args, None),
+        ('assessment_autosave', 'candidate', 'post', slug_args, {'_fields': []}),
+        ('survey_results', 'staff', 'get', lambda: (data.result_id,), None),
+        ('result_list', 'staff', 'get', lambda: (), None),
+        ('survey_result_list', 'staff', 'get', lambda: (data.surveys[0].slug,), None),
+        ('survey_result_export', 'staff', 'get', lambda: (data.surveys[0].slug,), None),
+        ('survey_result_statistics', 'staff', 'get', lambda: (data.surveys[0].slug,), None),
+        ('user_results', 'staff', 'get', lambda: (data.candidate.id,), None),
+        ('assessment_perf', 'staff', 'get', lambda: (), None),
+        ('assessment_authenticate', None, 'get', lambda: (make_login_token(data.candidate.id),), None),
+    ]
+
+
+def run_benchmarks(data, repeat=3):
+    """
+    Benchmark records for every URL, result submission and survey
+    duplication on the generated data.
+    """
+    clients = {None: Client(), 'staff': Client(), 'candidate': Client()}
+    users = {'staff': data.staff, 'candidate': data.candidate}
+    records = []
+    for name, role, method, args, post_data in url_benchmarks(data):
+        client = clients[role]
+
+        def setup(role=role, client=client, args=args):
+            if role is not None:
+                client.login(username=users[role].username, password=PASSWORD)
+            return (client, reverse('assessment:%s' % name, args=args()))
+
+        def run(client, path, method=method, post_data=post_data):
+            response = getattr(client, method)(path, post_data or {})
+            if response.streaming:
+                b''.join(response.streaming_content)
+            else:
+                response.content
+            return response.status_code
+        records.append(measure('url:%s' % name, run, setup, repeat))
+
+    survey = survey_cache.get_compiled_survey(data.open_survey.id)
+    answers = dict((question.field_key, str(question.choices[-1].id)) for question in survey.questions
+                   if question.choices)
+
+    def submission_setup():
+        form = ResultCreateForm(survey, create_user('%s@benchmark.test' % uuid4().hex), datetime.datetime.now(),
+                                data=answers)
+        form.is_valid()
+        return (form,)
+    records.append(measure('form:ResultCreateForm.save', lambda form: form.save() and 200, submission_setup, repeat))
+
+    # admin.py replaces the User admin, which needs admin.autodiscover() to
+    # have registered it first.
+    from assessment.admin import SurveyAdmin
+    admin = SurveyAdmin(Survey, site)
+    factory = RequestFactory()
+
+    def duplicate_setup():
+        Survey.objects.filter(name='%s (copy)' % data.open_survey.name).delete()
+        request = factory.post('/admin/')
+        request.user = data.staff
+        request._messages = CookieStorage(request)
+        return (request,)
+
+    def duplicate(request):
+        admin.duplicate(request, Survey.objects.filter(pk=data.open_survey.id))
+        return 200
+    records.append(measure('admin:SurveyAdmin.duplicate', duplicate, duplicate_setup, repeat))
+    for record in records:
+        record['size'] = data.size
+    return records
+
+
+def reset_caches():
+    cache.clear()
+    survey_cache._local_surveys.clear()
+    survey_cache._local_slugs.clear()
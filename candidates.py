@@ -0,0 +1,191 @@
+"""
+Bulk import of candidates from CSV or JSON.
+
+Each candidate row has an email address (also the username), names, optional
+profile fields, an optional password and the surveys to assign.  In CSV the
+surveys column is a ";" separated list of survey slugs, with "slug=url" for
+external surveys; in JSON it is a list of slugs or {"slug": ..., "url": ...}
+objects.
+
+Users, profiles and survey assignments are written with bulk_create in one
+transaction.  PBKDF2 is the slow part of creating a user, so the
+import_candidates command hashes passwords in a process pool.  The import
+view hashes them inline rather than fork its web worker, so it only takes
+files of at most ASSESSMENT_WEB_IMPORT_MAX_PASSWORDS passwords and
+ASSESSMENT_WEB_IMPORT_MAX_ROWS rows; larger ones go through the command.
+"""
+import csv
+import io
+import json
+import operator
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.urlresolvers import reverse
+from django.core.validators import validate_email
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from assessment.models import User, UserProfile, Survey, Available
+from assessment.tokens import make_login_token
+
+
+PROFILE_FIELDS = ('gender', 'phone_number', 'job_title', 'job_department', 'job_location', 'company',
+                  'assessment_protocol')
+BATCH_SIZE = 500
+# usernames per case-insensitive lookup query
+LOOKUP_BATCH_SIZE = 100
+WEB_IMPORT_MAX_PASSWORDS = getattr(settings, 'ASSESSMENT_WEB_IMPORT_MAX_PASSWORDS', 25)
+WEB_IMPORT_MAX_ROWS = getattr(settings, 'ASSESSMENT_WEB_IMPORT_MAX_ROWS', 2000)
+
+
+class CandidateImportError(Exception):
+    pass
+
+
+def read_candidates(data, format):
+    """
+    Parse CSV or JSON text into a list of candidate dicts whose 'surveys'
+    is a list of (slug, url) pairs.
+    """
+    if format == 'json':
+        try:
+            rows = json.loads(data)
+        except ValueError as e:
+            raise CandidateImportError('Invalid JSON: %s' % e)
+        if not isinstance(rows, list):
+            raise CandidateImportError('Expected a JSON list of candidates.')
+    elif format == 'csv':
+        rows = list(csv.DictReader(io.StringIO(data)))
+    else:
+        raise CandidateImportError('Unknown format: %s' % format)
+    candidates = []
+    for row in rows:
+        surveys = row.get('surveys') or []
+        if isinstance(surveys, str):
+            surveys = [survey.strip() for survey in surveys.split(';') if survey.strip()]
+        pairs = []
+        for survey in surveys:
+            if isinstance(survey, dict):
+                pairs.append((survey.get('slug', ''), survey.get('url', '')))
+            else:
+                slug, _, url = survey.partition('=')
+                pairs.append((slug.strip(), url.strip()))
+        candidate = dict((key, str(row.get(key) or '').strip()) for key in
+                         ('email', 'first_name', 'last_name', 'password') + PROFILE_FIELDS)
+        candidate['surveys'] = pairs
+        candidates.append(candidate)
+    return candidates
+
+
+def validate_candidates(candidates):
+    """
+    Return a list of error messages; an empty list means the import can run.
+    """
+    errors = []
+    seen = set()
+    for line, candidate in enumerate(candidates, 1):
+        email = candidate['email'].lower()
+        try:
+            validate_email(email)
+        except ValidationError:
+            errors.append('Row %s: invalid e-mail address "%s"' % (line, candidate['email']))
+        if email in seen:
+            errors.append('Row %s: duplicate e-mail address %s' % (line, email))
+        seen.add(email)
+        slugs = [slug for slug, url in candidate['surveys']]
+        for slug in sorted(set(slug for slug in slugs if slugs.count(slug) > 1)):
+            errors.append('Row %s: survey "%s" is listed more than once' % (line, slug))
+    emails = sorted(seen)
+    for i in range(0, len(emails), LOOKUP_BATCH_SIZE):
+        existing = User.objects.filter(reduce(operator.or_, [Q(username__iexact=email)
+                                                             for email in emails[i:i + LOOKUP_BATCH_SIZE]]))
+        for username in existing.values_list('username', flat=True):
+            errors.append('User %s already exists' % username)
+    slugs = set(slug for candidate in candidates for slug, url in candidate['surveys'])
+    known = set(Survey.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+    for slug in sorted(slugs - known):
+        errors.append('Survey "%s" does not exist' % slug)
+    return errors
+
+
+def web_import_errors(candidates):
+    """
+    Errors for a file too large to import within a web request.
+    """
+    errors = []
+    if len(candidates) > WEB_IMPORT_MAX_ROWS:
+        errors.append('The file has %s candidates; at most %s can be imported here.' % (
+            len(candidates), WEB_IMPORT_MAX_ROWS))
+    passwords = sum(1 for candidate in candidates if candidate['password'])
+    if passwords > WEB_IMPORT_MAX_PASSWORDS:
+        errors.append('The file sets %s passwords; at most %s can be hashed here. Leave the password column '
+                      'empty to use the login links instead.' % (passwords, WEB_IMPORT_MAX_PASSWORDS))
+    if errors:
+        errors.append('Import larger files with python manage.py import_candidates <file>.')
+    return errors
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    make_password over passwords, in a pool of workers processes if given;
+    None gives an unusable password (the candidate logs in with the magic
+    link).
+    """
+    if not workers:
+        return [make_password(password) for password in passwords]
+    # forked workers must not inherit the open database connection.
+    connection.close()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(make_password, passwords, chunksize=16))
+
+
+def import_candidates(candidates, workers=None):
+    """
+    Create the users, profiles and survey assignments of validated
+    candidates, hashing passwords in workers processes if given.  Returns
+    [(email, user id), ...].
+    """
+    passwords = hash_passwords([candidate['password'] or None for candidate in candidates], workers)
+    survey_ids = dict(Survey.objects.filter(
+        slug__in=set(slug for candidate in candidates for slug, url in candidate['surveys'])
+    ).values_list('slug', 'id'))
+    emails = [candidate['email'].lower() for candidate in candidates]
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(username=email, email=email, first_name=candidate['first_name'],
+                 last_name=candidate['last_name'], password=password)
+            for email, candidate, password in zip(emails, candidates, passwords)], batch_size=BATCH_SIZE)
+        # bulk_create does not return primary keys
+        user_ids = {}
+        for i in range(0, len(emails), BATCH_SIZE):
+            user_ids.update(User.objects.filter(username__in=emails[i:i + BATCH_SIZE]).values_list('username', 'id'))
+        profiles = []
+        assignments = []
+        for email, candidate in zip(emails, candidates):
+            profile = UserProfile(user_id=user_ids[email], profile_token=str(uuid4()))
+            for field in PROFILE_FIELDS:
+                setattr(profile, field, candidate[field])
+            profile.phone_number = ''.join(s for s in profile.phone_number if s.isdigit())
+            profiles.append(profile)
+            for slug, url in candidate['surveys']:
+                assignments.append(Available(user_id=user_ids[email], survey_id=survey_ids[slug], url=url))
+        UserProfile.objects.bulk_create(profiles, batch_size=BATCH_SIZE)
+        Available.objects.bulk_create(assignments, batch_size=BATCH_SIZE)
+    return [(email, user_ids[email]) for email in emails]
+
+
+def write_login_urls(output, domain, users):
+    """
+    Write an email,login_url CSV of the imported candidates to output.
+    """
+    writer = csv.writer(output)
+    writer.writerow(['email', 'login_url'])
+    for email, user_id in users:
+        token = make_login_token(user_id, epoch=0)
+        writer.writerow([email, ''.join(['http://', domain, reverse('assessment:assessment_authenticate',
+                                                                    args=(token,))])])
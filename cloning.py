@@ -0,0 +1,89 @@
+"""
+Copying surveys with their questions, choices and images.
+
+clone_surveys copies any number of surveys with a fixed number of queries:
+one prefetch of the sources, then one bulk_create per table, re-reading the
+new primary keys (which bulk_create does not return) to remap the foreign
+keys of the next table by survey and position.
+"""
+from django.db import transaction
+from django.utils.text import slugify
+
+from assessment.models import Survey, SurveyImage, Question, Choice
+from assessment.survey_cache import invalidate_catalog
+
+
+SURVEY_FIELDS = ('insertion', 'description', 'description_template', 'pub_date', 'external_survey_url',
+                 'minutes_allowed', 'is_active')
+
+
+class CloneError(Exception):
+    pass
+
+
+def clone_surveys(sources):
+    """
+    Copy each survey of [(survey, new name), ...] and return the copies in
+    the same order.  New names must give slugs not used by any survey.
+    """
+    slugs = [slugify(name) for survey, name in sources]
+    if len(set(slugs)) != len(slugs):
+        raise CloneError('The new survey names must be distinct.')
+    taken = list(Survey.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+    if taken:
+        raise CloneError('Survey "%s" already exists.' % taken[0])
+    originals = Survey.objects.prefetch_related('question_set__choice_set', 'images').in_bulk(
+        [survey.pk for survey, name in sources])
+    with transaction.atomic():
+        copies = []
+        for (survey, name), slug in zip(sources, slugs):
+            copy = Survey(name=name, slug=slug)
+            for field in SURVEY_FIELDS:
+                setattr(copy, field, getattr(survey, field))
+            copies.append(copy)
+        Survey.objects.bulk_create(copies)
+        # bulk_create does not return primary keys
+        survey_ids = dict(Survey.objects.filter(slug__in=slugs).values_list('slug', 'id'))
+        for copy in copies:
+            copy.id = survey_ids[copy.slug]
+
+        questions = []
+        choices = {}
+        images = []
+        for (survey, name), copy in zip(sources, copies):
+            original = originals[survey.pk]
+            for image in original.images.all():
+                images.append(SurveyImage(survey_id=copy.id, image=image.image.name))
+            choices[copy.id] = []
+            for question in original.question_set.all():
+                questions.append(Question(
+                    survey_id=copy.id, page_number=question.page_number, question_sum=question.question_sum,
+                    question_name=question.question_name, question=question.question,
+                    question_template=question.question_template, question_type=question.question_type))
+                choices[copy.id].append([Choice(choice_value=choice.choice_value,
+                                                choice_value_template=choice.choice_value_template,
+                                                weight=choice.weight)
+                                         for choice in question.choice_set.all()])
+        Question.objects.bulk_create(questions)
+        # new questions take ascending ids in insertion order within each copy;
+        # the remap is keyed on (copy, position) so it does not depend on how
+        # the copies themselves sort.
+        question_ids = {}
+        for question_id, survey_id in Question.objects.filter(survey_id__in=survey_ids.values()).order_by(
+                'id').values_list('id', 'survey_id'):
+            question_ids.setdefault(survey_id, []).append(question_id)
+        new_choices = []
+        for survey_id, survey_choices in choices.items():
+            for question_id, question_choices in zip(question_ids.get(survey_id, []), survey_choices):
+                for choice in question_choices:
+                    choice.question_id = question_id
+                    new_choices.append(choice)
+        Choice.objects.bulk_create(new_choices)
+        SurveyImage.objects.bulk_create(images)
+    # bulk_create sends no post_save
+    invalidate_catalog()
+    return copies
+
+
+def clone_survey(survey, name):
+    return clone_surveys([(survey, name)])[0]
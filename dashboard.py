@@ -0,0 +1,91 @@
+"""
+Per-user read model of assigned, pending and completed surveys.
+
+A candidate's dashboard is loaded with one query over the surveys assigned to
+or completed by the user, and cached per user.  Result and Available changes
+drop the user's entry (see the signal handlers in models.py); Survey changes
+bump a generation shared by every entry, since a renamed survey shows up on
+every dashboard it is assigned to.
+"""
+import uuid
+from collections import namedtuple, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+
+from assessment.models import Survey, Result, Available
+
+
+DASHBOARD_TIMEOUT = getattr(settings, 'ASSESSMENT_DASHBOARD_TIMEOUT', 60 * 60)
+
+DASHBOARD_KEY = 'assessment:dashboard:%s:%s'
+GENERATION_KEY = 'assessment:dashboard:generation'
+
+
+class DashboardSurvey(namedtuple('DashboardSurvey', 'id name slug available_id result_id completed_on')):
+    __slots__ = ()
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return reverse('assessment:assessment_survey', kwargs={'slug': self.slug})
+
+    def get_result_url(self):
+        return reverse('assessment:survey_results', kwargs={'pk': self.result_id})
+
+
+Dashboard = namedtuple('Dashboard', 'assigned pending completed')
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def load_dashboard(user_id):
+    available = Available._meta.db_table
+    result = Result._meta.db_table
+    survey = Survey._meta.db_table
+    available_id = 'SELECT a.id FROM %s a WHERE a.survey_id = %s.id AND a.user_id = %%s' % (available, survey)
+    result_where = 'FROM %s r WHERE r.survey_id = %s.id AND r.user_id = %%s' % (result, survey)
+    rows = Survey.objects.extra(
+        select=OrderedDict([
+            ('available_id', available_id),
+            ('result_id', 'SELECT r.id ' + result_where),
+            ('completed_on', 'SELECT r.completed_on ' + result_where),
+        ]),
+        select_params=(user_id, user_id, user_id),
+        where=['EXISTS (%s) OR EXISTS (SELECT 1 %s)' % (available_id, result_where)],
+        params=(user_id, user_id),
+    ).values_list('id', 'name', 'slug', 'available_id', 'result_id', 'completed_on')
+    surveys = [DashboardSurvey(*row) for row in rows]
+    assigned = [entry for entry in surveys if entry.available_id is not None]
+    # most recently assigned first
+    pending = sorted((entry for entry in assigned if entry.result_id is None),
+                     key=lambda entry: entry.available_id, reverse=True)
+    completed = sorted((entry for entry in surveys if entry.result_id is not None),
+                       key=lambda entry: entry.result_id)
+    return Dashboard(assigned, pending, completed)
+
+
+def get_dashboard(user_id):
+    key = DASHBOARD_KEY % (user_id, get_generation())
+    dashboard = cache.get(key)
+    if dashboard is None:
+        dashboard = load_dashboard(user_id)
+        cache.set(key, dashboard, DASHBOARD_TIMEOUT)
+    return dashboard
+
+
+def invalidate_dashboards(user_ids):
+    generation = get_generation()
+    cache.delete_many([DASHBOARD_KEY % (user_id, generation) for user_id in set(user_ids)])
+
+
+def invalidate_all_dashboards():
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
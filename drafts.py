@@ -0,0 +1,137 @@
+"""
+Cache-backed store of in-progress survey answers.
+
+Autosaved changes are merged into a draft held in the cache and written to
+the Draft table in batches: after DRAFT_FLUSH_CHANGES changes or
+DRAFT_FLUSH_SECONDS seconds, whichever comes first.  A draft maps form field
+keys to the submitted value, or list of values for multiple select
+questions.  Overlapping autosaves of one draft are merged under a lock held
+in the cache (cache.add), so neither drops the other's fields.
+"""
+import json
+import operator
+import time
+import uuid
+from contextlib import contextmanager
+from functools import reduce
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models import Q
+from django.utils.datastructures import MultiValueDict
+
+from assessment.models import Draft
+
+
+DRAFT_FLUSH_CHANGES = getattr(settings, 'ASSESSMENT_DRAFT_FLUSH_CHANGES', 20)
+DRAFT_FLUSH_SECONDS = getattr(settings, 'ASSESSMENT_DRAFT_FLUSH_SECONDS', 30)
+DRAFT_TIMEOUT = 60 * 60 * 24
+
+# seconds a writer that died keeps the draft locked
+DRAFT_LOCK_TIMEOUT = 5
+DRAFT_LOCK_WAIT = 0.02
+
+DRAFT_KEY = 'assessment:draft:%s:%s'
+LOCK_KEY = 'assessment:draft-lock:%s:%s'
+
+
+def load_entry(user_id, survey_id):
+    entry = cache.get(DRAFT_KEY % (user_id, survey_id))
+    if entry is None:
+        data = Draft.objects.filter(user_id=user_id, survey_id=survey_id).values_list('data', flat=True)[:1]
+        entry = {'data': json.loads(data[0]) if data and data[0] else {}, 'pending': 0, 'flushed_at': time.time()}
+    return entry
+
+
+def get_draft(user_id, survey_id):
+    return load_entry(user_id, survey_id)['data']
+
+
+def get_drafts(pairs):
+    """
+    {(user id, survey id): draft} for many drafts, reading the cache with
+    one get_many and the database with one query for the misses.
+    """
+    keys = dict((DRAFT_KEY % pair, pair) for pair in pairs)
+    drafts = dict((keys[key], entry['data']) for key, entry in cache.get_many(list(keys)).items())
+    missing = [pair for pair in pairs if pair not in drafts]
+    if missing:
+        rows = Draft.objects.filter(user_id__in=set(pair[0] for pair in missing),
+                                    survey_id__in=set(pair[1] for pair in missing)).values_list(
+            'user_id', 'survey_id', 'data')
+        missing = set(missing)
+        for user_id, survey_id, data in rows:
+            if (user_id, survey_id) in missing:
+                drafts[(user_id, survey_id)] = json.loads(data) if data else {}
+    return dict((pair, drafts.get(pair, {})) for pair in pairs)
+
+
+def discard_drafts(pairs):
+    if not pairs:
+        return
+    cache.delete_many([DRAFT_KEY % pair for pair in pairs])
+    Draft.objects.filter(reduce(operator.or_, [Q(user_id=user_id, survey_id=survey_id)
+                                               for user_id, survey_id in pairs])).delete()
+
+
+def flush_entry(user_id, survey_id, entry):
+    data = json.dumps(entry['data'])
+    if not Draft.objects.filter(user_id=user_id, survey_id=survey_id).update(data=data):
+        try:
+            Draft.objects.create(user_id=user_id, survey_id=survey_id, data=data)
+        except IntegrityError:
+            Draft.objects.filter(user_id=user_id, survey_id=survey_id).update(data=data)
+    entry['pending'] = 0
+    entry['flushed_at'] = time.time()
+
+
+@contextmanager
+def draft_lock(user_id, survey_id):
+    key = LOCK_KEY % (user_id, survey_id)
+    token = uuid.uuid4().hex
+    deadline = time.time() + DRAFT_LOCK_TIMEOUT
+    # past the deadline the holder's lock has expired
+    while not cache.add(key, token, DRAFT_LOCK_TIMEOUT) and time.time() < deadline:
+        time.sleep(DRAFT_LOCK_WAIT)
+    try:
+        yield
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def save_changes(user_id, survey_id, changes, flush=False):
+    """
+    Merge {field key: value} changes into the draft.  Returns True when the
+    draft was written to the database.
+    """
+    with draft_lock(user_id, survey_id):
+        entry = load_entry(user_id, survey_id)
+        entry['data'].update(changes)
+        entry['pending'] += len(changes)
+        flushed = False
+        if (flush or entry['pending'] >= DRAFT_FLUSH_CHANGES or
+                time.time() - entry['flushed_at'] >= DRAFT_FLUSH_SECONDS):
+            flush_entry(user_id, survey_id, entry)
+            flushed = True
+        cache.set(DRAFT_KEY % (user_id, survey_id), entry, DRAFT_TIMEOUT)
+    return flushed
+
+
+def discard_draft(user_id, survey_id):
+    cache.delete(DRAFT_KEY % (user_id, survey_id))
+    Draft.objects.filter(user_id=user_id, survey_id=survey_id).delete()
+
+
+def draft_form_data(draft, data=None):
+    """
+    Form data made of the draft overlaid with submitted data.
+    """
+    merged = MultiValueDict()
+    for key, value in draft.items():
+        merged.setlist(key, value if isinstance(value, list) else [value])
+    if data is not None:
+        for key in data:
+            merged.setlist(key, data.getlist(key))
+    return merged
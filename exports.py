@@ -0,0 +1,101 @@
+"""
+Streaming export of a survey's results and answers.
+
+Results are read in keyset-paged chunks (with their answers fetched per
+chunk), so an export runs in constant memory and the first rows are produced
+before the last ones are read.  Two layouts are available:
+
+ * long: one row per answer.
+ * wide: one row per result and one column per question.  Question names
+   used by more than one question get the question id appended, so every
+   column (and JSON key) is distinct.
+"""
+import csv
+import json
+from collections import Counter, defaultdict
+
+from assessment.models import Result, Answer
+
+
+LAYOUTS = ('long', 'wide')
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+RESULT_COLUMNS = ['result_id', 'username', 'email', 'started_on', 'completed_on', 'excess_seconds', 'score']
+
+
+class Echo(object):
+    """
+    File-like object whose write() returns the value, so csv.writer can
+    produce lines for a generator.
+    """
+    def write(self, value):
+        return value
+
+
+def question_column(question):
+    return question.question_name or 'question_%s' % question.id
+
+
+def wide_columns(questions):
+    names = [question_column(question) for question in questions]
+    counts = Counter(names + RESULT_COLUMNS)
+    return [name if counts[name] == 1 else '%s_%s' % (name, question.id) for name, question in zip(names, questions)]
+
+
+def result_chunks(survey_id, chunk_size):
+    """
+    Yield lists of (result values, {question id: answer}) paged by result id.
+    """
+    last_id = 0
+    while True:
+        results = list(Result.objects.filter(survey_id=survey_id, id__gt=last_id).order_by('id').values_list(
+            'id', 'user__username', 'user__email', 'started_on', 'completed_on', 'excess_seconds',
+            'total_score')[:chunk_size])
+        if not results:
+            return
+        last_id = results[-1][0]
+        answers = defaultdict(dict)
+        rows = Answer.objects.filter(result_id__in=[row[0] for row in results]).values_list(
+            'result_id', 'question_id', 'answer')
+        for result_id, question_id, answer in rows.iterator():
+            answers[result_id][question_id] = answer
+        yield [(list(row), answers[row[0]]) for row in results]
+
+
+def long_rows(compiled, chunk_size):
+    yield RESULT_COLUMNS + ['question_id', 'question', 'answer']
+    for chunk in result_chunks(compiled.id, chunk_size):
+        for result, answers in chunk:
+            for question in compiled.questions:
+                if question.id in answers:
+                    yield result + [question.id, question_column(question), answers[question.id]]
+
+
+def wide_rows(compiled, chunk_size):
+    yield RESULT_COLUMNS + wide_columns(compiled.questions)
+    for chunk in result_chunks(compiled.id, chunk_size):
+        for result, answers in chunk:
+            yield result + [answers.get(question.id, '') for question in compiled.questions]
+
+
+def export_results(compiled, layout='long', format='csv', chunk_size=500):
+    """
+    Return a generator of text chunks exporting every result of a compiled
+    survey.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError('Unknown export layout: %s' % layout)
+    if format not in FORMATS:
+        raise ValueError('Unknown export format: %s' % format)
+    rows = long_rows(compiled, chunk_size) if layout == 'long' else wide_rows(compiled, chunk_size)
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        return (writer.writerow(row) for row in rows)
+    return jsonl_lines(rows)
+
+
+def jsonl_lines(rows):
+    header = next(rows)
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), default=str) + '\n'
@@ -0,0 +1,63 @@
+"""
+Cached question markup of the survey page.
+
+A question rendered without answers or errors is the same HTML for every
+candidate, so the fragments of a survey are cached together, as one
+{question id: html} dict per compiled survey version: editing any Question,
+Choice or the Survey bumps the version (see survey_cache) and with it the
+key.  Questions with a draft answer, submitted data or errors are rendered
+live.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template import Context
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from assessment.models import Question
+
+
+FRAGMENT_TIMEOUT = getattr(settings, 'ASSESSMENT_SURVEY_CACHE_TIMEOUT', 60 * 60 * 24)
+FRAGMENT_TEMPLATE = 'assessment/survey_question.html'
+
+FRAGMENT_KEY = 'assessment:fragments:%s:%s'
+
+
+def is_pristine(form, question, keys):
+    """
+    Whether the question renders as it would for any candidate.
+    """
+    for key in keys:
+        if form.is_bound:
+            if key in form.data or key in form.errors:
+                return False
+        elif form.initial.get(key) not in (None, '', []):
+            return False
+    if question.question_type == Question.DISPOSITION and form.is_bound and form.non_field_errors():
+        return False
+    return True
+
+
+def question_fragments(form):
+    """
+    The rendered markup of each question of a ResultCreateForm, in order,
+    with one cache read and at most one cache write.
+    """
+    survey = form.survey
+    template = get_template(FRAGMENT_TEMPLATE)
+    key = FRAGMENT_KEY % (survey.id, survey.version)
+    cached = cache.get(key) or {}
+    fragments = []
+    missing = {}
+    for question, fields in form.question_fields():
+        pristine = is_pristine(form, question, [field.name for field in fields])
+        html = cached.get(question.id) if pristine else None
+        if html is None:
+            html = template.render(Context({'form': form, 'question': question, 'fields': fields}))
+            if pristine:
+                missing[question.id] = html
+        fragments.append(mark_safe(html))
+    if missing:
+        cached.update(missing)
+        cache.set(key, cached, FRAGMENT_TIMEOUT)
+    return fragments
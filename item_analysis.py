@@ -0,0 +1,191 @@
+"""
+Psychometric item analysis of a survey's scored questions.
+
+Each result is a row of the respondent x item matrix of choice weights.  The
+analysis only keeps sums over those rows (per item sums, sums of squares and
+cross products with the total score, plus choice counts), which are
+additive: results that arrived since the last refresh are loaded into a NumPy
+matrix and folded in, and the item statistics and Cronbach's alpha are
+derived from the sums in vectorized form.  The sums and the derived
+statistics are materialized in ItemAnalysis and ItemStatistic.
+
+A full rebuild happens when the items or their weights change, or when
+results were deleted.  Refreshing locks the survey's ItemAnalysis row and may
+read its whole history, so it stays off the request path: the sweep_attempts
+and item_analysis commands refresh every stale analysis and rescore refreshes
+the surveys it changed.  Pages only read it.
+"""
+import hashlib
+import json
+
+import numpy
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from assessment.models import Result, Answer, ItemAnalysis, ItemStatistic
+from assessment.scoring import weight_tables, selected_choices
+from assessment.survey_cache import get_compiled_survey
+
+
+CHUNK_SIZE = 1000
+
+
+def table_signature(items, tables):
+    definition = [[question_id, sorted(tables[question_id].weights.items())] for question_id in items]
+    return hashlib.md5(json.dumps(definition).encode('utf-8')).hexdigest()
+
+
+def empty_accumulators(items, signature):
+    size = len(items)
+    return {
+        'signature': signature,
+        'items': items,
+        'respondents': 0,
+        'item_sum': [0.0] * size,
+        'item_squares': [0.0] * size,
+        'item_total': [0.0] * size,
+        'total_sum': 0.0,
+        'total_squares': 0.0,
+        'counts': [{} for _ in items],
+    }
+
+
+def result_matrices(survey_id, items, tables, last_result_id):
+    """
+    Yield (last result id, respondent x item weight matrix, choice counts)
+    for the results after last_result_id, a chunk at a time.
+    """
+    column = dict((question_id, i) for i, question_id in enumerate(items))
+    while True:
+        result_ids = list(Result.objects.filter(survey_id=survey_id, id__gt=last_result_id).order_by(
+            'id').values_list('id', flat=True)[:CHUNK_SIZE])
+        if not result_ids:
+            return
+        row = dict((result_id, i) for i, result_id in enumerate(result_ids))
+        matrix = numpy.zeros((len(result_ids), len(items)))
+        counts = [{} for _ in items]
+        answers = Answer.objects.filter(result_id__in=result_ids, question_id__in=items).values_list(
+            'result_id', 'question_id', 'answer', 'choice_ids')
+        for result_id, question_id, answer, choice_ids in answers.iterator():
+            j = column[question_id]
+            table = tables[question_id]
+            for choice_id in selected_choices(table, answer, choice_ids)[0]:
+                value = table.values[choice_id]
+                matrix[row[result_id], j] += table.weights[choice_id]
+                counts[j][value] = counts[j].get(value, 0) + 1
+        last_result_id = result_ids[-1]
+        yield last_result_id, matrix, counts
+
+
+def fold(accumulators, matrix, counts):
+    totals = matrix.sum(axis=1)
+    accumulators['respondents'] += matrix.shape[0]
+    accumulators['item_sum'] = (numpy.array(accumulators['item_sum']) + matrix.sum(axis=0)).tolist()
+    accumulators['item_squares'] = (numpy.array(accumulators['item_squares']) + (matrix ** 2).sum(axis=0)).tolist()
+    accumulators['item_total'] = (numpy.array(accumulators['item_total']) + matrix.T.dot(totals)).tolist()
+    accumulators['total_sum'] += float(totals.sum())
+    accumulators['total_squares'] += float(totals.dot(totals))
+    for item_counts, chunk_counts in zip(accumulators['counts'], counts):
+        for value, count in chunk_counts.items():
+            item_counts[value] = item_counts.get(value, 0) + count
+
+
+def derive(accumulators):
+    """
+    Return (item means, item standard deviations, corrected item-total
+    correlations, Cronbach's alpha) from the accumulated sums.
+    """
+    n = accumulators['respondents']
+    size = len(accumulators['items'])
+    item_sum = numpy.array(accumulators['item_sum'])
+    if n < 2:
+        means = item_sum / n if n else numpy.zeros(size)
+        return means, numpy.zeros(size), [None] * size, None
+    item_squares = numpy.array(accumulators['item_squares'])
+    item_total = numpy.array(accumulators['item_total'])
+    total_sum = accumulators['total_sum']
+    item_variance = (item_squares - item_sum ** 2 / n) / (n - 1)
+    total_variance = (accumulators['total_squares'] - total_sum ** 2 / n) / (n - 1)
+    covariance = (item_total - item_sum * total_sum / n) / (n - 1)
+    # correlate each item with the total of the other items
+    rest_variance = total_variance - 2 * covariance + item_variance
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        correlations = (covariance - item_variance) / numpy.sqrt(item_variance * rest_variance)
+    correlations = [float(r) if numpy.isfinite(r) else None for r in correlations]
+    alpha = None
+    if size > 1 and total_variance > 0:
+        alpha = float(size / (size - 1.0) * (1 - item_variance.sum() / total_variance))
+    return item_sum / n, numpy.sqrt(numpy.maximum(item_variance, 0)), correlations, alpha
+
+
+def refresh_item_analysis(survey_id, rebuild=False):
+    """
+    Fold results submitted since the last refresh into the survey's
+    ItemAnalysis and return it.
+    """
+    compiled = get_compiled_survey(survey_id)
+    tables = weight_tables(compiled)
+    items = [question.id for question in compiled.questions if question.id in tables]
+    signature = table_signature(items, tables)
+    with transaction.atomic():
+        analysis, created = ItemAnalysis.objects.select_for_update().get_or_create(survey_id=survey_id)
+        accumulators = json.loads(analysis.accumulators) if analysis.accumulators else None
+        if (rebuild or accumulators is None or accumulators['signature'] != signature or
+                Result.objects.filter(survey_id=survey_id, id__lte=analysis.last_result_id).count()
+                != accumulators['respondents']):
+            accumulators = empty_accumulators(items, signature)
+            analysis.last_result_id = 0
+            changed = True
+        else:
+            changed = created
+        for last_result_id, matrix, counts in result_matrices(survey_id, items, tables, analysis.last_result_id):
+            fold(accumulators, matrix, counts)
+            analysis.last_result_id = last_result_id
+            changed = True
+        if not changed:
+            return analysis
+
+        means, deviations, correlations, alpha = derive(accumulators)
+        analysis.respondents = accumulators['respondents']
+        analysis.alpha = alpha
+        analysis.accumulators = json.dumps(accumulators)
+        analysis.save()
+        questions = dict((question.id, question) for question in compiled.questions)
+        statistics = []
+        for i, question_id in enumerate(items):
+            item_counts = accumulators['counts'][i]
+            distribution = [(choice.choice_value, item_counts.get(choice.choice_value, 0))
+                            for choice in questions[question_id].choices]
+            statistics.append(ItemStatistic(analysis=analysis, question_id=question_id, mean=float(means[i]),
+                                            std=float(deviations[i]), item_total_correlation=correlations[i],
+                                            distribution=json.dumps(distribution)))
+        ItemStatistic.objects.filter(analysis=analysis).delete()
+        ItemStatistic.objects.bulk_create(statistics)
+    return analysis
+
+
+def stale_surveys():
+    """
+    Ids of the surveys whose results were added or deleted since their item
+    analysis was last refreshed, in one aggregate query per table.
+    """
+    analyses = dict((survey_id, (respondents, last_result_id)) for survey_id, respondents, last_result_id in
+                    ItemAnalysis.objects.values_list('survey_id', 'respondents', 'last_result_id'))
+    stale = []
+    for row in Result.objects.values('survey_id').annotate(results=Count('id'), last=Max('id')).order_by():
+        if analyses.pop(row['survey_id'], None) != (row['results'], row['last']):
+            stale.append(row['survey_id'])
+    # analyses of surveys whose results were all deleted
+    stale.extend(survey_id for survey_id, (respondents, last_result_id) in analyses.items() if respondents)
+    return stale
+
+
+def refresh_stale_analyses():
+    """
+    Refresh the item analysis of every stale survey and return their ids.
+    """
+    survey_ids = stale_surveys()
+    for survey_id in survey_ids:
+        refresh_item_analysis(survey_id)
+    return survey_ids
@@ -0,0 +1,66 @@
+from collections import defaultdict
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from assessment.models import Survey, Result, Answer
+from assessment.scoring import weight_tables
+from assessment.snapshots import encode_snapshot, score_answers, write_snapshots
+from assessment.survey_cache import compile_survey
+
+
+class Command(BaseCommand):
+    args = '[<survey-slug>]'
+    help = ('Writes the snapshot of every result that has none, optionally of one survey only. Results with '
+            'answers that match no current choice are listed and left without one.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+                    help='Number of results written per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError('Usage: manage.py backfill_snapshots %s' % self.args)
+        results = Result.objects.filter(snapshot='')
+        if args:
+            try:
+                results = results.filter(survey=Survey.objects.get(slug=args[0]))
+            except Survey.DoesNotExist:
+                raise CommandError('Survey "%s" does not exist.' % args[0])
+        verbosity = int(options['verbosity'])
+        tables = {}
+        unmatched = []
+        done = 0
+        last_id = 0
+        while True:
+            batch = list(results.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'survey_id')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            answers = defaultdict(list)
+            rows = Answer.objects.filter(result_id__in=[row[0] for row in batch]).order_by(
+                'result', 'question').values_list('result_id', 'question_id', 'question__question', 'answer',
+                                                  'choice_ids')
+            for row in rows.iterator():
+                answers[row[0]].append(row[1:])
+            snapshots = {}
+            for result_id, survey_id in batch:
+                if survey_id not in tables:
+                    tables[survey_id] = weight_tables(compile_survey(survey_id, None))
+                snapshot_rows, total_score, unmatched_answers = score_answers(tables[survey_id], answers[result_id])
+                if unmatched_answers:
+                    unmatched.append(result_id)
+                    continue
+                snapshots[result_id] = encode_snapshot(snapshot_rows)
+            with transaction.atomic():
+                write_snapshots(snapshots)
+            done += len(snapshots)
+            if verbosity > 0:
+                self.stdout.write('%s results backfilled' % done)
+        self.stdout.write('Backfilled %s results' % done)
+        if unmatched:
+            self.stderr.write('Left %s results without a snapshot, their answers match no current choice: %s' % (
+                len(unmatched), ', '.join(str(result_id) for result_id in unmatched)))
@@ -0,0 +1,63 @@
+import json
+import sys
+from optparse import make_option
+
+from django.core.management import call_command
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from assessment.benchmarks import generate_data, run_benchmarks, reset_caches
+
+
+DEFAULT_SIZES = ('10,2,10,10', '100,5,40,200')
+
+
+class Command(NoArgsCommand):
+    help = ('Times every view, result submission and survey duplication on generated data in a test '
+            'database and writes the latency and query count of each as JSON.  Clears the cache, so do '
+            'not point it at a production cache.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--size', action='append', dest='sizes', default=None,
+                    help='USERS,SURVEYS,QUESTIONS,RESULTS of a data set; repeat for several sizes. '
+                         'Defaults to %s.' % ' and '.join(DEFAULT_SIZES)),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+                    help='Runs per benchmark; the first is reported as cold.'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write the JSON to, standard output by default.'),
+    )
+
+    def handle_noargs(self, **options):
+        sizes = []
+        for size in options['sizes'] or DEFAULT_SIZES:
+            try:
+                users, surveys, questions, results = [int(n) for n in size.split(',')]
+            except ValueError:
+                raise CommandError('A size is USERS,SURVEYS,QUESTIONS,RESULTS, not "%s".' % size)
+            if users < 1 or surveys < 1:
+                raise CommandError('A size needs at least one user and one survey.')
+            sizes.append((users, surveys, questions, results))
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            records = []
+            for size in sizes:
+                call_command('flush', interactive=False, verbosity=0)
+                reset_caches()
+                data = generate_data(*size)
+                records.extend(run_benchmarks(data, max(options['repeat'], 1)))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        reset_caches()
+
+        output = open(options['output'], 'w') if options['output'] else sys.stdout
+        try:
+            output.write(json.dumps(sorted(records, key=lambda record: (record['size'], record['name'])),
+                                    indent=2, sort_keys=True) + '\n')
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from assessment.models import Survey
+from assessment.cloning import CloneError, clone_surveys
+
+
+class Command(BaseCommand):
+    args = '<survey-slug> <new name> [<new name> ...]'
+    help = 'Copies a survey with its questions, choices and images once per new name.'
+
+    def handle(self, *args, **options):
+        if len(args) < 2:
+            raise CommandError('Usage: manage.py clone_survey %s' % self.args)
+        try:
+            survey = Survey.objects.get(slug=args[0])
+        except Survey.DoesNotExist:
+            raise CommandError('Survey "%s" does not exist.' % args[0])
+        try:
+            copies = clone_surveys([(survey, name) for name in args[1:]])
+        except CloneError as e:
+            raise CommandError(str(e))
+        for copy in copies:
+            self.stdout.write('Successfully created survey: %s' % copy.slug)
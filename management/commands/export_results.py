@@ -0,0 +1,37 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from assessment.models import Survey
+from assessment.exports import LAYOUTS, FORMATS, export_results
+from assessment.survey_cache import get_compiled_survey_by_slug
+
+
+class Command(BaseCommand):
+    args = '<survey-slug>'
+    help = 'Exports every result and answer of a survey as CSV or JSON lines.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--layout', dest='layout', default='long', choices=LAYOUTS,
+                    help='"long" (one row per answer) or "wide" (one column per question).'),
+        make_option('--format', dest='format', default='csv', choices=FORMATS,
+                    help='"csv" or "jsonl".'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write to, standard output by default.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: manage.py export_results %s' % self.args)
+        try:
+            compiled = get_compiled_survey_by_slug(args[0])
+        except Survey.DoesNotExist:
+            raise CommandError('Survey "%s" does not exist.' % args[0])
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in export_results(compiled, options['layout'], options['format']):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,37 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from assessment.models import Survey
+from assessment.survey_io import FORMATS, SurveyFormatError, export_survey, write_definition
+
+
+class Command(BaseCommand):
+    args = '<survey-slug>'
+    help = 'Writes the JSON or YAML definition of a survey, for import_survey.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='json', choices=FORMATS,
+                    help='"json" or "yaml".'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write to, standard output by default.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: manage.py export_survey %s' % self.args)
+        try:
+            survey = Survey.objects.get(slug=args[0])
+        except Survey.DoesNotExist:
+            raise CommandError('Survey "%s" does not exist.' % args[0])
+        try:
+            data = write_definition(export_survey(survey), options['format'])
+        except SurveyFormatError as e:
+            raise CommandError(str(e))
+        output = open(options['output'], 'w') if options['output'] else sys.stdout
+        try:
+            output.write(data + '\n')
+        finally:
+            if output is not sys.stdout:
+                output.close()
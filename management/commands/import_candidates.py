@@ -0,0 +1,46 @@
+import multiprocessing
+import sys
+from optparse import make_option
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+
+from assessment.candidates import (CandidateImportError, read_candidates, validate_candidates,
+                                   import_candidates, write_login_urls)
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = 'Creates candidates with their profiles and survey assignments from a CSV or JSON file.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None, choices=('csv', 'json'),
+                    help='Input format, guessed from the file extension by default.'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write the magic login URLs to, standard output by default.'),
+        make_option('--workers', type='int', dest='workers', default=multiprocessing.cpu_count(),
+                    help='Number of password hashing processes.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: manage.py import_candidates %s' % self.args)
+        format = options['format'] or ('json' if args[0].lower().endswith('.json') else 'csv')
+        with open(args[0], newline='') as f:
+            data = f.read()
+        try:
+            candidates = read_candidates(data, format)
+        except CandidateImportError as e:
+            raise CommandError(str(e))
+        errors = validate_candidates(candidates)
+        if errors:
+            raise CommandError('\n'.join(errors))
+        users = import_candidates(candidates, options['workers'])
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            write_login_urls(output, Site.objects.get_current().domain, users)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        if output is not sys.stdout:
+            self.stdout.write('Imported %s candidates, login URLs written to %s' % (len(users), options['output']))
@@ -0,0 +1,27 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from assessment.survey_io import FORMATS, SurveyFormatError, read_definition, import_survey
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = 'Creates a survey with its questions and choices from a JSON or YAML definition.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None, choices=FORMATS,
+                    help='Input format, guessed from the file extension by default.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: manage.py import_survey %s' % self.args)
+        format = options['format'] or ('yaml' if args[0].lower().endswith(('.yaml', '.yml')) else 'json')
+        with open(args[0]) as f:
+            data = f.read()
+        try:
+            survey = import_survey(read_definition(data, format))
+        except SurveyFormatError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Successfully created survey: %s' % survey.slug)
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from assessment.models import Survey
+from assessment.item_analysis import refresh_item_analysis, refresh_stale_analyses
+
+
+class Command(BaseCommand):
+    args = '[<survey-slug>]'
+    help = ('Refreshes and prints the item analysis and Cronbach\'s alpha of a survey, or refreshes every '
+            'survey with new or deleted results.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                    help='Recompute from every result instead of only the new ones.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError('Usage: manage.py item_analysis %s' % self.args)
+        if not args:
+            refreshed = refresh_stale_analyses()
+            self.stdout.write('Refreshed the item analysis of %s surveys' % len(refreshed))
+            return
+        try:
+            survey = Survey.objects.get(slug=args[0])
+        except Survey.DoesNotExist:
+            raise CommandError('Survey "%s" does not exist.' % args[0])
+        analysis = refresh_item_analysis(survey.id, rebuild=options['rebuild'])
+        self.stdout.write('%s: %s respondents, alpha %s' % (survey.slug, analysis.respondents, analysis.alpha))
+        for item in analysis.items.select_related('question'):
+            distribution = ', '.join('%s: %s' % (value, count) for value, count in item.get_distribution())
+            self.stdout.write('%s\tmean %.2f\tsd %.2f\tr %s\t%s' % (
+                item.question.question_name or item.question_id, item.mean, item.std,
+                item.item_total_correlation, distribution))
@@ -0,0 +1,132 @@
+import multiprocessing
+from collections import deque, defaultdict
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from assessment.models import Survey, Result, Answer
+from assessment import survey_stats
+from assessment.item_analysis import refresh_item_analysis
+from assessment.scoring import weight_tables
+from assessment.snapshots import encode_snapshot, score_answers, write_snapshots
+from assessment.survey_cache import compile_survey
+
+
+def score_chunk(tables, chunk):
+    """
+    Score [(result id, [(question id, question, answer text, choice ids),
+    ...]), ...] and return [(result id, score, snapshot, unmatched answers),
+    ...].  Runs in a worker process.
+    """
+    scores = []
+    for result_id, answers in chunk:
+        rows, total_score, unmatched = score_answers(tables, answers)
+        scores.append((result_id, total_score, encode_snapshot(rows), unmatched))
+    return scores
+
+
+class Command(BaseCommand):
+    args = '<survey-slug>'
+    help = ('Recomputes the score and snapshot of every result of a survey from the current choice weights. '
+            'Results with answers that match no current choice are listed and left unchanged.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Print the scores that would change without writing them.'),
+        make_option('--workers', type='int', dest='workers', default=multiprocessing.cpu_count(),
+                    help='Number of scoring processes.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=1000,
+                    help='Number of results scored per chunk.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: manage.py rescore %s' % self.args)
+        try:
+            survey = Survey.objects.get(slug=args[0])
+        except Survey.DoesNotExist:
+            raise CommandError('Survey "%s" does not exist.' % args[0])
+        self.dry_run = options['dry_run']
+        self.verbosity = int(options['verbosity'])
+        tables = weight_tables(compile_survey(survey.id, None))
+        total = Result.objects.filter(survey=survey).count()
+        self.done = 0
+        self.changed = 0
+        self.unmatched = []
+
+        # Pool forks every worker here, before chunks() reopens the database
+        # connection, so no worker inherits its socket.
+        connection.close()
+        workers = max(options['workers'], 1)
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            pending = deque()
+            for current, chunk in self.chunks(survey, options['chunk_size']):
+                pending.append((current, pool.apply_async(score_chunk, (tables, chunk))))
+                if len(pending) >= workers * 2:
+                    self.write_scores(*pending.popleft(), total=total)
+            while pending:
+                self.write_scores(*pending.popleft(), total=total)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        if not self.dry_run and self.changed:
+            survey_stats.invalidate(survey.id)
+        if not self.dry_run:
+            # new weights change the item analysis signature: rebuild it
+            refresh_item_analysis(survey.id)
+        self.stdout.write('%s %s of %s results of %s' % (
+            'Would change' if self.dry_run else 'Changed', self.changed, total, survey.slug))
+        if self.unmatched:
+            self.stderr.write('Left %s results unchanged, their answers match no current choice: %s' % (
+                len(self.unmatched), ', '.join(str(result_id) for result_id in self.unmatched)))
+
+    def chunks(self, survey, chunk_size):
+        """
+        Yield ({result id: (score, total_score, snapshot)}, [(result id,
+        answers), ...]) chunks, paging over results by id so memory stays
+        constant.
+        """
+        last_id = 0
+        while True:
+            results = list(Result.objects.filter(survey=survey, id__gt=last_id).order_by('id').values_list(
+                'id', 'score', 'total_score', 'snapshot')[:chunk_size])
+            if not results:
+                return
+            last_id = results[-1][0]
+            answers = defaultdict(list)
+            rows = Answer.objects.filter(result_id__in=[row[0] for row in results]).order_by(
+                'result', 'question').values_list('result_id', 'question_id', 'question__question', 'answer',
+                                                  'choice_ids')
+            for row in rows.iterator():
+                answers[row[0]].append(row[1:])
+            current = dict((row[0], row[1:]) for row in results)
+            yield current, [(row[0], answers[row[0]]) for row in results]
+
+    def write_scores(self, current, scored, total):
+        by_score = defaultdict(list)
+        snapshots = {}
+        for result_id, total_score, snapshot, unmatched in scored.get():
+            if unmatched:
+                self.unmatched.append(result_id)
+                continue
+            score, old_total_score, old_snapshot = current[result_id]
+            if score != '%s' % total_score or old_total_score != total_score:
+                by_score[total_score].append(result_id)
+                if self.dry_run:
+                    self.stdout.write('result %s: %s -> %s' % (result_id, score, total_score))
+            if snapshot != old_snapshot:
+                snapshots[result_id] = snapshot
+        if not self.dry_run:
+            # one UPDATE per distinct score in the chunk, and the changed
+            # snapshots in batches.
+            with transaction.atomic():
+                for total_score, ids in by_score.items():
+                    Result.objects.filter(id__in=ids).update(score='%s' % total_score, total_score=total_score)
+                write_snapshots(snapshots)
+        self.changed += sum(len(ids) for ids in by_score.values())
+        self.done += len(current)
+        if self.verbosity > 0:
+            self.stdout.write('%s/%s results scored' % (self.done, total))
@@ -0,0 +1,29 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from assessment.attempts import ATTEMPT_GRACE_SECONDS, BATCH_SIZE, expired_attempts, finalize_expired
+from assessment.item_analysis import refresh_stale_analyses
+
+
+class Command(NoArgsCommand):
+    help = ('Submits the saved answers of every timed attempt left open past its deadline, then refreshes '
+            'the item analysis of the surveys with new results.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--grace', type='int', dest='grace', default=ATTEMPT_GRACE_SECONDS,
+                    help='Seconds past the deadline before an attempt is finalized.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=BATCH_SIZE,
+                    help='Number of attempts finalized per batch.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Print the number of expired attempts without finalizing them.'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['dry_run']:
+            self.stdout.write('%s expired attempts' % expired_attempts(grace=options['grace']).count())
+            return
+        finalized = finalize_expired(grace=options['grace'], batch_size=options['batch_size'])
+        self.stdout.write('Finalized %s expired attempts' % finalized)
+        refreshed = refresh_stale_analyses()
+        self.stdout.write('Refreshed the item analysis of %s surveys' % len(refreshed))
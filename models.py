@@ -1,8 +1,10 @@
 import datetime
-from django.db import models
+import json
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
-from django.db.models.signals import post_delete, post_save
+from django.core.signals import request_finished
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.db.models.signals import class_prepared
 from django.core.validators import MaxLengthValidator
 from django.utils.translation import ugettext as _
@@ -51,6 +53,8 @@ class Survey(models.Model):
     slug = models.SlugField(max_length=255)
     insertion = models.CharField(max_length=200, blank=True)
     description = models.TextField()
+    # the description as written, when it has insertion placeholders
+    description_template = models.TextField(blank=True, default='', editable=False)
     pub_date = models.DateTimeField(auto_now=False, default=datetime.datetime.now)
     external_survey_url = models.CharField(max_length=255, blank=True)
     minutes_allowed = models.FloatField(max_length=10, default=0)
@@ -75,17 +79,23 @@ class Survey(models.Model):
             return False
 
     def save(self, *args, **kwargs):
-        varprocs1 = [self.insertion]
-        i = 0
-        if self.insertion is not "":
-            while i < 20:
-                try:
-                    self.description = self.description % tuple(varprocs1)
-                except TypeError:
-                    i += 1
-                    varprocs1.append(self.insertion)
+        from assessment.templating import rendered, rerender_survey
+        from assessment.survey_cache import invalidate_survey, invalidate_pending
+        old_insertion = None
+        if self.pk:
+            old_insertion = Survey.objects.filter(pk=self.pk).values_list('insertion', flat=True).first()
+        self.description, self.description_template = rendered(
+            self.description, self.description_template, self.insertion,
+            self.insertion if old_insertion is None else old_insertion)
         self.slug = slugify(self.name)
-        super(Survey, self).save(*args, **kwargs)
+        with transaction.atomic():
+            super(Survey, self).save(*args, **kwargs)
+            if old_insertion is not None and old_insertion != self.insertion:
+                # a rebrand: update every question and choice in one batch
+                rerender_survey(self.pk, self.insertion)
+                invalidate_survey(self.pk)
+        # the invalidations above ran before the commit
+        invalidate_pending()
 
 
 class SurveyImage(models.Model):
@@ -130,6 +140,7 @@ class Question(models.Model):
     question_sum = models.IntegerField(max_length=25, blank=True, null=True)
     question_name = models.CharField(max_length=255)
     question = models.TextField()
+    question_template = models.TextField(blank=True, default='', editable=False)
     question_type = models.IntegerField(
         max_length=1,
         choices=QUESTION_TYPE,
@@ -145,15 +156,11 @@ class Question(models.Model):
         return self.question
 
     def save(self, *args, **kwargs):
-        varprocs1 = [self.survey.insertion]
-        i = 0
-        if self.survey.insertion is not "":
-            while i < 20:
-                try:
-                    self.question = self.question % tuple(varprocs1)
-                except TypeError:
-                    i += 1
-                    varprocs1.append(self.survey.insertion)
+        from assessment.templating import has_placeholders, rendered
+        if self.question_template or has_placeholders(self.question):
+            insertion = self.survey.insertion
+            self.question, self.question_template = rendered(self.question, self.question_template, insertion,
+                                                             insertion)
         if self.question_sum is None:
             self.question_sum = 100
         super(Question, self).save(*args, **kwargs)
@@ -162,6 +169,7 @@ class Question(models.Model):
 class Choice(models.Model):
     question = models.ForeignKey(Question)
     choice_value = models.TextField(max_length=500)
+    choice_value_template = models.TextField(blank=True, default='', editable=False)
     weight = models.FloatField(max_length=10, default=0)
 
     class Meta:
@@ -172,15 +180,12 @@ class Choice(models.Model):
         return self.choice_value
 
     def save(self, *args, **kwargs):
-        varprocs1 = [self.question.survey.insertion]
-        i = 0
-        if self.question.survey.insertion is not "":
-            while i < 20:
-                try:
-                    self.choice_value = self.choice_value % tuple(varprocs1)
-                except TypeError:
-                    i += 1
-                    varprocs1.append(self.question.survey.insertion)
+        from assessment.templating import has_placeholders, rendered
+        if self.choice_value_template or has_placeholders(self.choice_value):
+            insertion = Survey.objects.filter(question__id=self.question_id).values_list(
+                'insertion', flat=True).first()
+            self.choice_value, self.choice_value_template = rendered(self.choice_value, self.choice_value_template,
+                                                                     insertion, insertion)
         super(Choice, self).save(*args, **kwargs)
 
 
@@ -191,10 +196,19 @@ class Result(models.Model):
     completed_on = models.DateTimeField(auto_now=True, default=datetime.datetime.now)
     excess_seconds = models.IntegerField(editable=False)
     score = models.CharField(max_length=10, default=0, editable=False)
+    total_score = models.FloatField(default=0, editable=False)
+    # JSON [[question id, question, answer, score], ...] written at submit time
+    snapshot = models.TextField(blank=True, default='', editable=False)
 
     class Meta:
         app_label = 'assessment'
         unique_together = ('survey', 'user')
+        # keyset pagination and filtering of the result lists
+        index_together = [
+            ('completed_on', 'id'),
+            ('survey', 'completed_on', 'id'),
+            ('user', 'completed_on', 'id'),
+        ]
 
     def __str__(self):
         return "%s, %s" % (self.survey, self.user)
@@ -202,11 +216,23 @@ class Result(models.Model):
     def get_absolute_url(self):
         return reverse('assessment:survey_results', kwargs={'pk': self.id})
 
+    def get_snapshot(self):
+        """
+        [{'question_id', 'question', 'answer', 'score'}, ...] in survey order;
+        score is None for unscored questions.
+        """
+        if not self.snapshot:
+            return []
+        return [dict(zip(('question_id', 'question', 'answer', 'score'), row)) for row in json.loads(self.snapshot)]
+
 
 class Answer(models.Model):
     result = models.ForeignKey(Result, related_name='answers', editable=False)
     question = models.ForeignKey(Question, related_name='answers', editable=False)
     answer = models.TextField(blank=True, null=True)
+    # "id,id,..." of the choices picked, so rescoring does not depend on
+    # matching the answer text; empty for answers stored before it existed.
+    choice_ids = models.TextField(blank=True, default='', editable=False)
 
     class Meta:
         app_label = 'assessment'
@@ -218,6 +244,95 @@ class Answer(models.Model):
         return self.answer
 
 
+class Attempt(models.Model):
+    """
+    A candidate's sitting of a survey, from the first page view until the
+    result is submitted or the sweeper closes it.  Untimed surveys have no
+    deadline.
+    """
+    user = models.ForeignKey(User, related_name='attempts', editable=False)
+    survey = models.ForeignKey(Survey, related_name='attempts', editable=False)
+    started_on = models.DateTimeField(editable=False)
+    deadline = models.DateTimeField(blank=True, null=True, db_index=True, editable=False)
+    finished_on = models.DateTimeField(blank=True, null=True, editable=False)
+
+    class Meta:
+        app_label = 'assessment'
+        unique_together = ('survey', 'user')
+        index_together = [('finished_on', 'deadline')]
+
+    def __str__(self):
+        return "%s, %s" % (self.survey, self.user)
+
+    def remaining_seconds(self, now=None):
+        if self.deadline is None:
+            return None
+        delta = self.deadline - (now or datetime.datetime.now())
+        return delta.days * 86400 + delta.seconds
+
+
+class Draft(models.Model):
+    """
+    In-progress answers of a survey, keyed by form field.  Written in batches
+    from the cache-backed draft store (see drafts.py).
+    """
+    user = models.ForeignKey(User, related_name='drafts', editable=False)
+    survey = models.ForeignKey(Survey, related_name='drafts', editable=False)
+    data = models.TextField(blank=True, editable=False)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'assessment'
+        unique_together = ('survey', 'user')
+
+    def __str__(self):
+        return "%s, %s" % (self.survey, self.user)
+
+
+class ItemAnalysis(models.Model):
+    """
+    Materialized psychometric analysis of a survey.  accumulators holds the
+    running sums the statistics are derived from, so results submitted after
+    last_result_id can be folded in without rereading older answers.
+    """
+    survey = models.OneToOneField(Survey, related_name='item_analysis', editable=False)
+    respondents = models.IntegerField(default=0, editable=False)
+    last_result_id = models.IntegerField(default=0, editable=False)
+    alpha = models.FloatField(blank=True, null=True, editable=False)
+    accumulators = models.TextField(blank=True, editable=False)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'assessment'
+
+    def __str__(self):
+        return "%s item analysis" % self.survey
+
+
+class ItemStatistic(models.Model):
+    analysis = models.ForeignKey(ItemAnalysis, related_name='items', editable=False)
+    question = models.ForeignKey(Question, related_name='item_statistics', editable=False)
+    mean = models.FloatField(default=0, editable=False)
+    std = models.FloatField(default=0, editable=False)
+    item_total_correlation = models.FloatField(blank=True, null=True, editable=False)
+    distribution = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        app_label = 'assessment'
+        ordering = ['analysis', 'question']
+
+    def __str__(self):
+        return "%s" % self.question
+
+    def get_distribution(self):
+        """
+        [(choice value, count), ...] in choice order.
+        """
+        if not self.distribution:
+            return []
+        return json.loads(self.distribution)
+
+
 class UserProfile(models.Model):
     user = models.ForeignKey(User, unique=True)
     gender = models.CharField(max_length=MAX_LENGTH, blank=True, null=True)
@@ -228,6 +343,7 @@ class UserProfile(models.Model):
     company = models.CharField(max_length=MAX_LENGTH, blank=True, null=True)
     assessment_protocol = models.CharField(max_length=MAX_LENGTH, blank=True, null=True)
     profile_token = models.CharField(max_length=MAX_LENGTH, blank=True, null=True, unique=True)
+    token_epoch = models.IntegerField(default=0)
 
     def get_absolute_url(self):
         return reverse('assessment:assessment_results', args=(user.id,))
@@ -238,11 +354,9 @@ class UserProfile(models.Model):
         super(UserProfile, self).save(*args, **kwargs)
 
 
-def create_user_profile(sender, instance, **kwargs):
-    try:
-        UserProfile.objects.create(user=instance)
-    except:
-        pass
+def create_user_profile(sender, instance, created, **kwargs):
+    if created:
+        UserProfile.objects.get_or_create(user=instance)
 
 
 def delete_user_profile(sender, instance, **kwargs):
@@ -252,5 +366,69 @@ def delete_user_profile(sender, instance, **kwargs):
         pass
 
 
+def invalidate_user_cache(sender, instance, **kwargs):
+    from assessment.auth import invalidate_user
+    invalidate_user(instance)
+
+
 post_save.connect(create_user_profile, sender=User)
 post_delete.connect(delete_user_profile, sender=User)
+post_save.connect(invalidate_user_cache, sender=User)
+post_delete.connect(invalidate_user_cache, sender=User)
+
+
+def invalidate_survey_cache(sender, instance, **kwargs):
+    from assessment.survey_cache import invalidate_for_instance
+    invalidate_for_instance(instance)
+
+
+post_save.connect(invalidate_survey_cache, sender=Survey)
+post_delete.connect(invalidate_survey_cache, sender=Survey)
+post_save.connect(invalidate_survey_cache, sender=Question)
+post_delete.connect(invalidate_survey_cache, sender=Question)
+post_save.connect(invalidate_survey_cache, sender=Choice)
+post_delete.connect(invalidate_survey_cache, sender=Choice)
+post_save.connect(invalidate_survey_cache, sender=SurveyImage)
+post_delete.connect(invalidate_survey_cache, sender=SurveyImage)
+
+
+def invalidate_survey_cache_after_commit(sender, **kwargs):
+    from assessment.survey_cache import invalidate_pending
+    invalidate_pending()
+
+
+request_finished.connect(invalidate_survey_cache_after_commit)
+
+
+def announce_result(sender, instance, **kwargs):
+    from assessment import survey_stats
+    if instance.pk is None:
+        survey_stats.result_adding(instance)
+
+
+def update_survey_statistics(sender, instance, created=False, **kwargs):
+    from assessment import survey_stats
+    survey_stats.result_changed(instance, created)
+
+
+pre_save.connect(announce_result, sender=Result)
+post_save.connect(update_survey_statistics, sender=Result)
+post_delete.connect(update_survey_statistics, sender=Result)
+
+
+def invalidate_user_dashboard(sender, instance, **kwargs):
+    from assessment.dashboard import invalidate_dashboards
+    invalidate_dashboards([instance.user_id])
+
+
+def invalidate_all_dashboards(sender, instance, **kwargs):
+    from assessment import dashboard
+    dashboard.invalidate_all_dashboards()
+
+
+post_save.connect(invalidate_user_dashboard, sender=Result)
+post_delete.connect(invalidate_user_dashboard, sender=Result)
+post_save.connect(invalidate_user_dashboard, sender=Available)
+post_delete.connect(invalidate_user_dashboard, sender=Available)
+post_save.connect(invalidate_all_dashboards, sender=Survey)
+post_delete.connect(invalidate_all_dashboards, sender=Survey)
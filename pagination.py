@@ -0,0 +1,96 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are fetched with a WHERE clause on the sort keys of the last row of the
+previous page instead of an OFFSET, so every page costs the same index range
+scan however deep the candidate is in the list.  Cursors are signed so they
+cannot be used to inject arbitrary filter values.
+"""
+import operator
+from functools import reduce
+
+from django.core import signing
+from django.db.models import Q
+
+
+CURSOR_SALT = 'assessment.pagination'
+
+
+class KeysetPage(object):
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def key_value(obj, key):
+    for name in key.split('__'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def key_field(model, key):
+    """
+    The model field a key such as 'completed_on' or 'user__last_name'
+    refers to.
+    """
+    names = key.split('__')
+    for name in names[:-1]:
+        model = model._meta.get_field(name).rel.to
+    return model._meta.get_field(names[-1])
+
+
+def encode_cursor(obj, keys):
+    return signing.dumps([str(key_value(obj, key)) for key in keys], salt=CURSOR_SALT)
+
+
+def decode_cursor(model, keys, cursor):
+    """
+    Return the key values stored in cursor, or None for a missing or
+    tampered cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        values = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    if len(values) != len(keys):
+        return None
+    return [key_field(model, key).to_python(value) for key, value in zip(keys, values)]
+
+
+def after(keys, values, descending):
+    """
+    Q object selecting rows that sort after values, i.e. the tuple comparison
+    (k1, k2, ...) > (v1, v2, ...) written out for the ORM.
+    """
+    lookup = 'lt' if descending else 'gt'
+    clauses = []
+    for i, key in enumerate(keys):
+        clause = Q(**{'%s__%s' % (key, lookup): values[i]})
+        for previous_key, previous_value in zip(keys[:i], values[:i]):
+            clause &= Q(**{previous_key: previous_value})
+        clauses.append(clause)
+    return reduce(operator.or_, clauses)
+
+
+def keyset_paginate(queryset, keys, cursor=None, per_page=50, descending=True):
+    """
+    Return the KeysetPage of queryset following cursor, ordered by keys,
+    which may span relations ('user__last_name').  The last key must be
+    unique (normally 'id').
+    """
+    values = decode_cursor(queryset.model, keys, cursor)
+    if values is not None:
+        queryset = queryset.filter(after(keys, values, descending))
+    ordering = ['-%s' % key if descending else key for key in keys]
+    object_list = list(queryset.order_by(*ordering)[:per_page + 1])
+    next_cursor = None
+    if len(object_list) > per_page:
+        object_list = object_list[:per_page]
+        next_cursor = encode_cursor(object_list[-1], keys)
+    return KeysetPage(object_list, next_cursor)
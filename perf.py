@@ -0,0 +1,178 @@
+"""
+Opt-in per-request instrumentation.
+
+Add 'assessment.perf.PerfMiddleware' to MIDDLEWARE_CLASSES to record, for each
+request, the number and time of SQL queries, query shapes executed more than
+once (a sign of N+1 queries) and template render time.  They are sent back in
+a Server-Timing header and the last ASSESSMENT_PERF_WINDOW samples of each URL
+name are kept in the cache for the staff-only perf page.
+
+QueryBudgetMixin gives test cases assertQueryBudget, which fails a test that
+runs more queries than its budget and lists the duplicated query shapes.
+"""
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.template.base import Template
+from django.test.utils import CaptureQueriesContext
+
+
+PERF_WINDOW = getattr(settings, 'ASSESSMENT_PERF_WINDOW', 200)
+PERCENTILES = (50, 90, 99)
+
+SAMPLES_KEY = 'assessment:perf:%s'
+NAMES_KEY = 'assessment:perf:names'
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+LISTS = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+
+_state = threading.local()
+_original_render = None
+
+
+def query_shape(sql):
+    """
+    sql with its literal values replaced, so queries differing only in
+    parameters compare equal.
+    """
+    return LISTS.sub('(...)', LITERALS.sub('?', sql))
+
+
+def duplicated_shapes(queries):
+    """
+    [(shape, count), ...] of the query shapes run more than once, most
+    repeated first.
+    """
+    counts = Counter(query_shape(query['sql']) for query in queries)
+    return [(shape, count) for shape, count in counts.most_common() if count > 1]
+
+
+def instrumented_render(self, context):
+    depth = getattr(_state, 'depth', None)
+    if depth is None:
+        return _original_render(self, context)
+    _state.depth = depth + 1
+    start = time.time()
+    try:
+        return _original_render(self, context)
+    finally:
+        _state.depth -= 1
+        # extends and include render nested templates; count the outermost only.
+        if _state.depth == 0:
+            _state.template_seconds += time.time() - start
+
+
+def install_template_timer():
+    global _original_render
+    if _original_render is None:
+        _original_render = Template._render
+        Template._render = instrumented_render
+
+
+def record_sample(url_name, sample):
+    key = SAMPLES_KEY % url_name
+    samples = cache.get(key) or []
+    samples.append(sample)
+    cache.set(key, samples[-PERF_WINDOW:], None)
+    names = cache.get(NAMES_KEY) or set()
+    if url_name not in names:
+        names.add(url_name)
+        cache.set(NAMES_KEY, names, None)
+
+
+def perf_report():
+    """
+    Per URL name: request count, total/SQL/template millisecond percentiles,
+    mean query count and the most duplicated query shapes of the window.
+    """
+    names = sorted(cache.get(NAMES_KEY) or ())
+    all_samples = cache.get_many([SAMPLES_KEY % name for name in names])
+    report = []
+    for name in names:
+        samples = all_samples.get(SAMPLES_KEY % name)
+        if not samples:
+            continue
+        columns = numpy.array([sample[:4] for sample in samples], dtype=float)
+        total, sql, queries, template = columns.T
+        report.append({
+            'name': name,
+            'count': len(samples),
+            'total': list(zip(PERCENTILES, numpy.percentile(total, PERCENTILES))),
+            'sql': list(zip(PERCENTILES, numpy.percentile(sql, PERCENTILES))),
+            'template': list(zip(PERCENTILES, numpy.percentile(template, PERCENTILES))),
+            'queries': float(queries.mean()),
+            'max_queries': int(queries.max()),
+            'duplicates': max(sample[4] for sample in samples),
+        })
+    return report
+
+
+class PerfMiddleware(object):
+
+    def __init__(self):
+        install_template_timer()
+
+    def process_request(self, request):
+        request._perf_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        request._perf_start = (time.time(), len(connection.queries))
+        _state.depth = 0
+        _state.template_seconds = 0.0
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_perf_start'):
+            return response
+        start, first_query = request._perf_start
+        total = time.time() - start
+        queries = connection.queries[first_query:]
+        connection.use_debug_cursor = request._perf_debug_cursor
+        template = getattr(_state, 'template_seconds', 0.0)
+        _state.depth = None
+        sql = sum(float(query['time']) for query in queries)
+        duplicates = duplicated_shapes(queries)
+        response['Server-Timing'] = ', '.join([
+            'sql;dur=%.1f;desc="%s queries, %s duplicated shapes"' % (sql * 1000, len(queries), len(duplicates)),
+            'tpl;dur=%.1f' % (template * 1000),
+            'total;dur=%.1f' % (total * 1000),
+        ])
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.url_name:
+            url_name = '%s:%s' % (match.namespace, match.url_name) if match.namespace else match.url_name
+            record_sample(url_name, [total * 1000, sql * 1000, len(queries), template * 1000,
+                                     sum(count - 1 for shape, count in duplicates)])
+        return response
+
+
+class QueryBudgetMixin(object):
+    """
+    assertQueryBudget(budget) is a context manager that fails the test when
+    the code inside runs more than budget queries, listing the duplicated
+    query shapes.
+    """
+
+    def assertQueryBudget(self, budget):
+        return QueryBudgetContext(self, budget)
+
+
+class QueryBudgetContext(CaptureQueriesContext):
+
+    def __init__(self, test_case, budget):
+        super(QueryBudgetContext, self).__init__(connection)
+        self.test_case = test_case
+        self.budget = budget
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(QueryBudgetContext, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        if len(self) > self.budget:
+            duplicates = '\n'.join('%sx %s' % (count, shape) for shape, count in duplicated_shapes(self.captured_queries))
+            self.test_case.fail('%s queries run, budget is %s. Duplicated query shapes:\n%s' % (
+                len(self), self.budget, duplicates or 'none'))
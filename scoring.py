@@ -0,0 +1,93 @@
+"""
+Scoring of stored answers.
+
+Answers record the ids of the choices picked (Answer.choice_ids), which are
+scored against the current weights directly.  Answers stored before that
+only have their text: the choice value for single choice questions and
+"value, value, ..." in choice order for multiple select questions.  That text
+is matched against each choice's current value and, for templated choices,
+against its template with any insertion, so it still resolves after the
+insertion of the survey changed.  Text that matches no choice, or picks a
+choice whose value another choice of a different weight shares, is reported
+as unmatched instead of being scored as zero.
+"""
+import re
+from collections import namedtuple
+
+from assessment.models import Question, Choice
+from assessment.survey_cache import SCORED_TYPES
+from assessment.templating import template_pattern
+
+
+# stored for choice questions answered with no choice
+NO_RESPONSE = 'No Response'
+
+
+class ScoringTable(namedtuple('ScoringTable', 'question_type weights values pattern ambiguous')):
+    """
+    The choices of a scored question: weights and values by choice id, the
+    compiled pattern of its answer text (one named group per choice) and the
+    ids of the choices whose text does not tell them apart.
+    """
+
+
+def answer_pattern(question_type, choices, templates):
+    groups = []
+    for choice in choices:
+        alternatives = [re.escape(choice.choice_value)]
+        if choice.id in templates:
+            alternatives.append(template_pattern(templates[choice.id]))
+        groups.append('(?P<c%s>%s)' % (choice.id, '|'.join(alternatives)))
+    if question_type == Question.MULTISELECT:
+        # matched against the answer with a trailing ', '
+        return re.compile('^%s$' % ''.join('(?:%s, )?' % group for group in groups), re.DOTALL)
+    return re.compile('^(?:%s)$' % '|'.join(groups), re.DOTALL)
+
+
+def weight_tables(compiled):
+    """
+    question id -> ScoringTable for the scored questions of a compiled
+    survey.  Reads the choice templates with one query.
+    """
+    templates = dict(Choice.objects.filter(question__survey_id=compiled.id).exclude(
+        choice_value_template='').values_list('id', 'choice_value_template'))
+    tables = {}
+    for question in compiled.questions:
+        if question.question_type in SCORED_TYPES:
+            weights_by_value = {}
+            for choice in question.choices:
+                weights_by_value.setdefault(choice.choice_value, set()).add(choice.weight)
+            tables[question.id] = ScoringTable(
+                question.question_type,
+                dict((choice.id, choice.weight) for choice in question.choices),
+                dict((choice.id, choice.choice_value) for choice in question.choices),
+                answer_pattern(question.question_type, question.choices, templates),
+                frozenset(choice.id for choice in question.choices
+                          if len(weights_by_value[choice.choice_value]) > 1))
+    return tables
+
+
+def selected_choices(table, answer, choice_ids=''):
+    """
+    (ids of the choices picked in a stored answer, whether every pick was
+    resolved to a current choice).
+    """
+    if choice_ids:
+        ids = [int(choice_id) for choice_id in choice_ids.split(',')]
+        known = [choice_id for choice_id in ids if choice_id in table.weights]
+        return known, len(known) == len(ids)
+    if not answer:
+        return [], True
+    match = table.pattern.match(answer + ', ' if table.question_type == Question.MULTISELECT else answer)
+    if match is None:
+        return [], answer == NO_RESPONSE
+    ids = [int(name[1:]) for name, value in match.groupdict().items() if value is not None]
+    return ids, table.ambiguous.isdisjoint(ids)
+
+
+def answer_score(table, answer, choice_ids=''):
+    """
+    (points scored by a stored answer, whether it was resolved).
+    """
+    ids, matched = selected_choices(table, answer, choice_ids)
+    return sum(table.weights[choice_id] for choice_id in ids), matched
@@ -10,3 +10,39 @@ AUTHENTICATION_BACKENDS = (
     'assessment.auth.EmailOrUsernameModelBackend',
     'django.contrib.auth.backends.ModelBackend'
 )
+
+# Compiled survey snapshots are kept in the default cache; use a cache shared
+# between worker processes (memcached, redis, database) in production.
+ASSESSMENT_SURVEY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Lifetime in seconds of the signed magic-login links, and whether links built
+# from UserProfile.profile_token are still accepted.
+ASSESSMENT_LOGIN_TOKEN_MAX_AGE = 60 * 60 * 24 * 30
+ASSESSMENT_ACCEPT_PROFILE_TOKENS = True
+
+# Seconds a user stays in the login/session user cache.
+ASSESSMENT_USER_CACHE_TIMEOUT = 60 * 60
+
+# Autosaved answers are written from the cache to the database after this many
+# changes or seconds, whichever comes first.
+ASSESSMENT_DRAFT_FLUSH_CHANGES = 20
+ASSESSMENT_DRAFT_FLUSH_SECONDS = 30
+
+# Seconds past a timed survey's deadline before sweep_attempts submits the saved answers.
+ASSESSMENT_ATTEMPT_GRACE_SECONDS = 300
+
+# Seconds a candidate's survey dashboard stays cached.
+ASSESSMENT_DASHBOARD_TIMEOUT = 60 * 60
+
+# Number of recent requests per URL kept for the /_perf/ page.  Recording is
+# off unless 'assessment.perf.PerfMiddleware' is added to MIDDLEWARE_CLASSES.
+ASSESSMENT_PERF_WINDOW = 200
+
+# Seconds a survey's cached score statistics are kept before they are rebuilt.
+ASSESSMENT_STATS_TIMEOUT = 60 * 60
+
+# The most candidates, and candidate passwords, the import page accepts per
+# file.  Passwords are hashed within the request; use the import_candidates
+# command for larger files.
+ASSESSMENT_WEB_IMPORT_MAX_ROWS = 2000
+ASSESSMENT_WEB_IMPORT_MAX_PASSWORDS = 25
@@ -0,0 +1,63 @@
+"""
+Denormalized result snapshots.
+
+Result.snapshot holds, for every question, the question text, the answer and
+the points it scored, so a result page is rendered from the Result row alone.
+ResultCreateForm writes it at submit time; results stored before snapshots
+existed are filled in by the backfill_snapshots command, and rescore rewrites
+the snapshots whose scores change.  Both leave alone the results with answers
+that match no current choice.
+"""
+import json
+
+from django.db import connection
+
+from assessment.models import Result
+from assessment.scoring import answer_score
+
+
+# results per UPDATE: three parameters each stays under SQLite's limit of 999
+WRITE_BATCH_SIZE = 300
+
+
+def encode_snapshot(rows):
+    """
+    rows are (question id, question, answer, score or None) tuples.
+    """
+    return json.dumps([list(row) for row in rows], separators=(',', ':'))
+
+
+def score_answers(tables, answers):
+    """
+    Snapshot rows, total score and number of unmatched answers (see
+    scoring.selected_choices) of [(question id, question, answer, choice
+    ids), ...] stored answers, given scoring.weight_tables of the survey.
+    """
+    rows = []
+    total_score = 0
+    unmatched = 0
+    for question_id, question, answer, choice_ids in answers:
+        score = None
+        if question_id in tables:
+            score, matched = answer_score(tables[question_id], answer, choice_ids)
+            total_score += score
+            unmatched += not matched
+        rows.append((question_id, question, answer, score))
+    return rows, total_score, unmatched
+
+
+def write_snapshots(snapshots):
+    """
+    Store {result id: snapshot} with one UPDATE per WRITE_BATCH_SIZE results.
+    """
+    table = connection.ops.quote_name(Result._meta.db_table)
+    column = connection.ops.quote_name('snapshot')
+    pk = connection.ops.quote_name('id')
+    items = list(snapshots.items())
+    cursor = connection.cursor()
+    for start in range(0, len(items), WRITE_BATCH_SIZE):
+        batch = items[start:start + WRITE_BATCH_SIZE]
+        params = [value for item in batch for value in item] + [result_id for result_id, snapshot in batch]
+        cursor.execute('UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+            table, column, pk, ' '.join(['WHEN %s THEN %s'] * len(batch)), pk, ', '.join(['%s'] * len(batch))),
+            params)
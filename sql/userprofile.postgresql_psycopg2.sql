@@ -0,0 +1,11 @@
+-- Indexes for the user directory: case-insensitive prefix search (istartswith
+-- compiles to UPPER(column::text) LIKE UPPER('prefix%')) and the
+-- (last_name, id) keyset ordering.  The e-mail index also serves the
+-- email__iexact login lookup (UPPER(email::text) = UPPER('address')).
+CREATE INDEX assessment_userprofile_company_prefix ON assessment_userprofile (UPPER(company::text) text_pattern_ops);
+CREATE INDEX assessment_userprofile_job_department_prefix ON assessment_userprofile (UPPER(job_department::text) text_pattern_ops);
+CREATE INDEX assessment_userprofile_assessment_protocol_prefix ON assessment_userprofile (UPPER(assessment_protocol::text) text_pattern_ops);
+CREATE INDEX assessment_auth_user_last_name_prefix ON auth_user (UPPER(last_name::text) text_pattern_ops);
+CREATE INDEX assessment_auth_user_first_name_prefix ON auth_user (UPPER(first_name::text) text_pattern_ops);
+CREATE INDEX assessment_auth_user_email_prefix ON auth_user (UPPER(email::text) text_pattern_ops);
+CREATE INDEX assessment_auth_user_last_name_id ON auth_user (last_name, id);
@@ -0,0 +1,255 @@
+"""
+Compiled, immutable snapshots of survey definitions.
+
+A survey with its questions, choices, weights and form field keys is loaded
+with a single prefetch and compiled into plain tuples.  Snapshots are kept in
+a process-local dict and in the shared Django cache, keyed by a per-survey
+version that is bumped whenever a Survey, Question, Choice or SurveyImage is
+saved or deleted (see the signal handlers at the bottom of models.py).
+
+The shared cache must be shared between worker processes (memcached, redis,
+database cache) for invalidation to reach every process.
+
+A change saved inside a transaction bumps the version before the transaction
+commits, so a concurrent request may compile the old rows and cache them
+under the new version.  Such surveys are invalidated again by
+invalidate_pending once no transaction is open: at the end of every request
+(request_finished) and of Survey.save.
+"""
+import threading
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from assessment.models import Survey, Question, Choice, SurveyImage
+
+
+SURVEY_CACHE_TIMEOUT = getattr(settings, 'ASSESSMENT_SURVEY_CACHE_TIMEOUT', 60 * 60 * 24)
+
+VERSION_KEY = 'assessment:survey:%s:version'
+SNAPSHOT_KEY = 'assessment:survey:%s:%s'
+SLUG_KEY = 'assessment:survey-slug:%s'
+CATALOG_KEY = 'assessment:survey-catalog'
+
+# question types whose choice weights add up to Result.total_score
+SCORED_TYPES = (Question.TRUEFALSE, Question.MULTICHOICE, Question.MULTISELECT)
+
+# survey id -> CompiledSurvey, slug -> survey id
+_local_surveys = {}
+_local_slugs = {}
+# survey ids and slugs invalidated while a transaction was open
+_pending = threading.local()
+
+
+class CompiledChoice(namedtuple('CompiledChoice', 'id choice_value weight field_key')):
+
+    def __str__(self):
+        return self.choice_value
+
+
+class CompiledQuestion(namedtuple('CompiledQuestion', 'id question_name question question_type '
+                                                      'page_number question_sum field_key choices')):
+
+    def __str__(self):
+        return self.question
+
+    @property
+    def field_keys(self):
+        if self.question_type == Question.DISPOSITION:
+            return [choice.field_key for choice in self.choices]
+        return [self.field_key]
+
+
+class CompiledSurvey(namedtuple('CompiledSurvey', 'id name slug description insertion external_survey_url '
+                                                  'minutes_allowed is_active images questions choices_by_id '
+                                                  'weights version')):
+
+    def __str__(self):
+        return self.name
+
+    def score(self, choice_ids):
+        """
+        Total weight of the submitted choice ids; choices of unscored
+        question types count as zero.
+        """
+        weights = self.weights
+        return sum(weights.get(choice_id, 0) for choice_id in choice_ids)
+
+    @property
+    def page_numbers(self):
+        return sorted(set(question.page_number for question in self.questions)) or [1]
+
+    def page_questions(self, page_number):
+        return tuple(question for question in self.questions if question.page_number == page_number)
+
+    def get_external_url(self):
+        if 'https://' in self.external_survey_url or 'http://' in self.external_survey_url:
+            return self.external_survey_url
+        else:
+            return False
+
+
+class CatalogSurvey(namedtuple('CatalogSurvey', 'id name slug external_survey_url')):
+
+    def __str__(self):
+        return self.name
+
+
+def compile_survey(survey_id, version):
+    """
+    Load a survey with one prefetch and return its CompiledSurvey.
+    """
+    survey = Survey.objects.prefetch_related('question_set__choice_set', 'images').get(pk=survey_id)
+    questions = []
+    choices_by_id = {}
+    weights = {}
+    for question in survey.question_set.all():
+        field_key = str(question.id)
+        choices = []
+        for choice in question.choice_set.all():
+            choice_key = None
+            if question.question_type == Question.DISPOSITION:
+                choice_key = field_key + choice.choice_value
+            compiled_choice = CompiledChoice(choice.id, choice.choice_value, choice.weight, choice_key)
+            choices.append(compiled_choice)
+            choices_by_id[choice.id] = compiled_choice
+            if question.question_type in SCORED_TYPES:
+                weights[choice.id] = choice.weight
+        questions.append(CompiledQuestion(
+            question.id, question.question_name, question.question, question.question_type,
+            int(question.page_number), question.question_sum, field_key, tuple(choices)))
+    images = tuple(image.image.url for image in survey.images.all() if image.image)
+    return CompiledSurvey(
+        survey.id, survey.name, survey.slug, survey.description, survey.insertion,
+        survey.external_survey_url, survey.minutes_allowed, survey.is_active, images,
+        tuple(questions), choices_by_id, weights, version)
+
+
+def get_survey_version(survey_id):
+    version = cache.get(VERSION_KEY % survey_id)
+    if version is None:
+        cache.add(VERSION_KEY % survey_id, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY % survey_id)
+    return version
+
+
+def get_compiled_survey(survey_id):
+    """
+    Return the CompiledSurvey for survey_id.  Costs one shared cache read when
+    the process-local snapshot is current.  Raises Survey.DoesNotExist.
+    """
+    version = get_survey_version(survey_id)
+    compiled = _local_surveys.get(survey_id)
+    if compiled is not None and compiled.version == version:
+        return compiled
+    compiled = cache.get(SNAPSHOT_KEY % (survey_id, version))
+    if compiled is None:
+        try:
+            compiled = compile_survey(survey_id, version)
+        except Survey.DoesNotExist:
+            _local_surveys.pop(survey_id, None)
+            raise
+        cache.set(SNAPSHOT_KEY % (survey_id, version), compiled, SURVEY_CACHE_TIMEOUT)
+    _local_surveys[survey_id] = compiled
+    return compiled
+
+
+def get_compiled_survey_by_slug(slug):
+    survey_id = _local_slugs.get(slug) or cache.get(SLUG_KEY % slug)
+    if survey_id is not None:
+        try:
+            compiled = get_compiled_survey(survey_id)
+            if compiled.slug == slug:
+                _local_slugs[slug] = survey_id
+                return compiled
+        except Survey.DoesNotExist:
+            pass
+        _local_slugs.pop(slug, None)
+        cache.delete(SLUG_KEY % slug)
+    survey_id = Survey.objects.filter(slug=slug).values_list('id', flat=True)[:1]
+    if not survey_id:
+        raise Survey.DoesNotExist("Survey matching slug '%s' does not exist." % slug)
+    survey_id = survey_id[0]
+    cache.set(SLUG_KEY % slug, survey_id, SURVEY_CACHE_TIMEOUT)
+    _local_slugs[slug] = survey_id
+    return get_compiled_survey(survey_id)
+
+
+def get_survey_catalog():
+    """
+    Every survey as a CatalogSurvey, in publication order.  Dropped whenever
+    a survey is saved or deleted.
+    """
+    catalog = cache.get(CATALOG_KEY)
+    if catalog is None:
+        catalog = [CatalogSurvey(*row) for row in
+                   Survey.objects.values_list('id', 'name', 'slug', 'external_survey_url')]
+        cache.set(CATALOG_KEY, catalog, SURVEY_CACHE_TIMEOUT)
+    return catalog
+
+
+def invalidate_catalog():
+    cache.delete(CATALOG_KEY)
+
+
+def pending():
+    if not hasattr(_pending, 'survey_ids'):
+        _pending.survey_ids = set()
+        _pending.slugs = set()
+    return _pending
+
+
+def invalidate_survey(survey_id):
+    cache.set(VERSION_KEY % survey_id, uuid.uuid4().hex, None)
+    _local_surveys.pop(survey_id, None)
+    if transaction.get_connection().in_atomic_block:
+        pending().survey_ids.add(survey_id)
+
+
+def invalidate_slug(slug):
+    invalidate_catalog()
+    cache.delete(SLUG_KEY % slug)
+    _local_slugs.pop(slug, None)
+    if transaction.get_connection().in_atomic_block:
+        pending().slugs.add(slug)
+
+
+def invalidate_pending():
+    """
+    Invalidate again what was invalidated inside transactions, once none is
+    open any more.
+    """
+    if transaction.get_connection().in_atomic_block:
+        return
+    state = pending()
+    survey_ids, slugs = state.survey_ids, state.slugs
+    state.survey_ids, state.slugs = set(), set()
+    for slug in slugs:
+        invalidate_slug(slug)
+    for survey_id in survey_ids:
+        invalidate_survey(survey_id)
+
+
+def invalidate_for_instance(instance):
+    """
+    Bump the version of the survey a Survey, Question, Choice or SurveyImage
+    belongs to.
+    """
+    if isinstance(instance, Survey):
+        invalidate_slug(instance.slug)
+        survey_id = instance.id
+    elif isinstance(instance, (Question, SurveyImage)):
+        survey_id = instance.survey_id
+    elif isinstance(instance, Choice):
+        try:
+            survey_id = instance.question.survey_id
+        except Question.DoesNotExist:
+            # deleted along with its question, which invalidates on its own.
+            return
+    else:
+        return
+    if survey_id is not None:
+        invalidate_survey(survey_id)
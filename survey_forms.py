@@ -7,106 +7,152 @@ from django.forms import ModelForm
 from django.forms.models import inlineformset_factory, BaseInlineFormSet
 from django.core.exceptions import ValidationError
 
-from assessment.models import Survey, Result, Choice, Question, Answer
+from assessment import survey_stats
+from assessment.models import Survey, Result, Choice, Question, Answer, Attempt
+from assessment.scoring import NO_RESPONSE
+from assessment.survey_cache import SCORED_TYPES
+from assessment.snapshots import encode_snapshot
 
 
 class ResultCreateForm(forms.ModelForm):
 
-    def __init__(self, survey, user, started_on, *args, **kwargs):
+    def __init__(self, survey, user, started_on, page_number=None, *args, **kwargs):
         super(ResultCreateForm, self).__init__(*args, **kwargs)
         self.user = user      # required for the save method.
-        self.survey = survey  # required for the save method.
-        self.started_on = started_on  # required for the save method.
-        for question in survey.question_set.all():
+        self.survey = survey  # a CompiledSurvey, required for the save method.
+        self.started_on = started_on  # a datetime, required for the save method.
+        # a form for one page only validates and renders that page's questions.
+        self.page_number = page_number
+        self.questions = survey.questions if page_number is None else survey.page_questions(page_number)
+        for question in self.questions:
+            options = [(choice.id, choice.choice_value) for choice in question.choices]
             if question.question_type == Question.TRUEFALSE or question.question_type == Question.MULTICHOICE or question.question_type == Question.RANGE:
-                self.fields.insert(len(self.fields), str(question.id),
-                           forms.ModelChoiceField(queryset=Choice.objects.filter(
-                               question=question), widget=forms.RadioSelect(), empty_label=None, required=False, help_text=question.question_name))
-                self.fields[str(question.id)].label = str(question)
+                self.fields[question.field_key] = forms.ChoiceField(choices=options, widget=forms.RadioSelect(),
+                    required=False, help_text=question.question_name, label=str(question))
             elif question.question_type == Question.DISPOSITION:
-                for choice in question.choice_set.all():
-                    self.fields[str(question.id) + choice.choice_value] = forms.CharField(help_text=choice.question.question_name, max_length=3, label=choice.choice_value,
-                        required=False, widget=forms.TextInput(attrs={'size': '1', 'id': str(question.id) + choice.choice_value}))
+                for choice in question.choices:
+                    self.fields[choice.field_key] = forms.CharField(help_text=question.question_name, max_length=3, label=choice.choice_value,
+                        required=False, widget=forms.TextInput(attrs={'size': '1', 'id': choice.field_key}))
             elif question.question_type == Question.TEXT:
-                self.fields.insert(len(self.fields), str(question.id),
-                           forms.CharField(widget=forms.Textarea(attrs={'class': "col-md-12", 'rows': 30}), required=False, help_text=question.question_name))
-                self.fields[str(question.id)].label = str(question)
+                self.fields[question.field_key] = forms.CharField(widget=forms.Textarea(attrs={'class': "col-md-12", 'rows': 30}),
+                    required=False, help_text=question.question_name, label=str(question))
             elif question.question_type == Question.EXTERNAL:
-                self.fields.insert(len(self.fields), str(question.id),
-                           forms.CharField(required=False))
-                self.fields[str(question.id)].label = str(question)
+                self.fields[question.field_key] = forms.CharField(required=False, label=str(question))
             elif question.question_type == Question.MULTISELECT:
-                self.fields.insert(len(self.fields), str(question.id),
-                           forms.ModelMultipleChoiceField(queryset=Choice.objects.filter(
-                               question=question), widget=forms.CheckboxSelectMultiple(), required=False, help_text=question.question_name))
-                self.fields[str(question.id)].label = str(question)
+                self.fields[question.field_key] = forms.MultipleChoiceField(choices=options, widget=forms.CheckboxSelectMultiple(),
+                    required=False, help_text=question.question_name, label=str(question))
+
+    def question_fields(self):
+        """
+        (question, [bound fields]) pairs in survey order, so a template can
+        render every field exactly once.
+        """
+        return [(question, [self[key] for key in question.field_keys if key in self.fields])
+                for question in self.questions]
+
+    def page_data(self):
+        """
+        The submitted values of this form's questions, in draft form.
+        """
+        data = {}
+        for question in self.questions:
+            for key in question.field_keys:
+                if question.question_type == Question.MULTISELECT:
+                    data[key] = self.data.getlist(key)
+                elif key in self.data:
+                    data[key] = self.data.get(key)
+        return data
 
     def clean(self):
         cleaned_data = super(ResultCreateForm, self).clean()
-        for question in self.survey.question_set.all():
+        for question in self.questions:
             if question.question_type == Question.DISPOSITION:
                 answer_string = ''
                 answer_sum = 0
-                for choice in question.choice_set.all():
+                for choice in question.choices:
                     try:
-                        answer_string += choice.choice_value + ':' + str(cleaned_data.get(str(question.id) + choice.choice_value)) + ', '
-                        answer_sum += int(cleaned_data.get(str(question.id) + choice.choice_value))
-                    except ValueError:
+                        answer_string += choice.choice_value + ':' + str(cleaned_data.get(choice.field_key)) + ', '
+                        answer_sum += int(cleaned_data.get(choice.field_key))
+                    except (TypeError, ValueError):
                         raise ValidationError("Enter Numeric values, write zeros for blank answers")
                 if answer_string is not '':
                     if answer_sum != question.question_sum:
                         raise ValidationError("Questions which ask for numerical values must sum to " + str(question.question_sum))
-                self.cleaned_data[str(question.id)] = answer_string
+                self.cleaned_data[question.field_key] = answer_string
         return self.cleaned_data
 
-    def save(self, *args, **kwargs):
+    def selected_choice_ids(self, question):
+        value = self.cleaned_data.get(question.field_key)
+        if not value:
+            return []
+        if question.question_type == Question.MULTISELECT:
+            return [int(choice_id) for choice_id in value]
+        return [int(value)]
+
+    def selected_choices(self, question):
         """
-        Django has already validated all the answers at this point.
+        The CompiledChoices picked for a choice question, in survey order.
         """
-        instance = super(ResultCreateForm, self).save(commit=False)
+        selected = set(self.selected_choice_ids(question))
+        return [choice for choice in question.choices if choice.id in selected]
+
+    def answer_text(self, question):
+        if question.question_type in (Question.TRUEFALSE, Question.MULTICHOICE, Question.RANGE, Question.MULTISELECT):
+            answer = ', '.join(choice.choice_value for choice in self.selected_choices(question))
+        else:
+            answer = self.cleaned_data.get(question.field_key)
+        return answer or NO_RESPONSE
+
+    def build_result(self, now=None):
+        """
+        The unsaved Result and its unsaved Answers for the cleaned data of a
+        whole-survey form.  Also used on invalid forms, scoring whichever
+        answers did validate.
+        """
+        now = now or datetime.datetime.now()
+        instance = self.instance
         instance.user = self.user
-        instance.survey = self.survey
-        total_score = 0
-        for question in self.survey.question_set.all():
-            if question.question_type == Question.TRUEFALSE or question.question_type == Question.MULTICHOICE:
-                for choice in question.choice_set.all():
-                    if choice == self.cleaned_data[str(question.id)]:
-                        total_score += choice.weight
-            elif question.question_type == Question.MULTISELECT:
-                for choice in question.choice_set.all():
-                    if choice in self.cleaned_data[str(question.id)]:
-                        total_score += choice.weight
+        instance.survey_id = self.survey.id
+        choice_ids = []
+        rows = []
+        picked = {}
+        for question in self.survey.questions:
+            score = None
+            if question.question_type in SCORED_TYPES:
+                selected = self.selected_choice_ids(question)
+                choice_ids.extend(selected)
+                picked[question.id] = ','.join(str(choice.id) for choice in self.selected_choices(question))
+                score = self.survey.score(selected)
+            rows.append((question.id, question.question, self.answer_text(question), score))
+        total_score = self.survey.score(choice_ids)
         instance.started_on = self.started_on
         instance.score = "%s" % total_score
+        instance.total_score = total_score
         instance.excess_seconds = 0
         if self.survey.minutes_allowed > 0:
-            delta = datetime.datetime.now() - datetime.datetime.strptime(self.started_on, "%Y-%m-%d %H:%M:%S.%f")
+            delta = now - self.started_on
             delta = delta.days * 86400 + delta.seconds
             if delta > 60 * self.survey.minutes_allowed:
                 instance.excess_seconds = delta - 60 * self.survey.minutes_allowed
-        instance.save()
-
-        # bulk_create Answer Objects start here!
-        response_id = instance.id                                       # 1. grab the id of the newly created response.
-        start_ans_id = response_id * 1000                               # 2. Multiply by 1000. This is the initial answer id. 1000 because no survey will be that long
-        end_ans_id = start_ans_id + self.survey.question_set.count()    # 3. survey_instance.question_set.count() has the amount of questions
-        ans_ids = list(range(start_ans_id, end_ans_id))                 # 4. Generate a list over which to iterate,
-        q_answers = []
-        for question in self.survey.question_set.all():
-            if self.cleaned_data[str(question.id)]:
-                cleaned_answer = self.cleaned_data[str(question.id)]
-                if not isinstance(cleaned_answer, models.Model) and not isinstance(cleaned_answer, str):
-                    choices_list = [cleaned_answer.choice_value for cleaned_answer in cleaned_answer]
-                    cleaned_answer = ', '.join(choices_list)
-                q_answers.append(cleaned_answer)
-            else:
-                q_answers.append("No Response")
-        zipped = zip(ans_ids, self.survey.question_set.all(), q_answers) # Zip it so we can create Answer instances.
-        data = [Answer(id=answer_id,          # the data is actually a list of answers_instances.
-                       result=instance,       # They will be committed to disk on the bulk_create() method.
-                       question=question_obj,
-                       answer=ans_value) for answer_id, question_obj, ans_value in zipped]
-        Answer.objects.bulk_create(data) #used Bulk_create to save IO resources
+        instance.snapshot = encode_snapshot(rows)
+        answers = [Answer(question_id=question_id, answer=answer, choice_ids=picked.get(question_id, ''))
+                   for question_id, question, answer, score in rows]
+        return instance, answers
+
+    def save(self, *args, **kwargs):
+        """
+        Django has already validated all the answers at this point.
+        """
+        now = datetime.datetime.now()
+        instance, answers = self.build_result(now)
+        # one Result insert and one multi-row Answer insert, committed together;
+        # the score statistics are updated once they are.
+        with survey_stats.atomic():
+            instance.save()
+            for answer in answers:
+                answer.result = instance
+            Answer.objects.bulk_create(answers)
+            Attempt.objects.filter(user=self.user, survey_id=self.survey.id).update(finished_on=now)
         return instance
 
     class Meta:
@@ -0,0 +1,202 @@
+"""
+Declarative survey definitions.
+
+A definition is a JSON (or YAML, when PyYAML is installed) object:
+
+    {"name": ..., "description": ..., "insertion": ..., "minutes_allowed": ...,
+     "external_survey_url": ..., "is_active": ..., "images": [...],
+     "choices": [{"choice_value": ..., "weight": ...}, ...],
+     "questions": [{"question": ..., "question_name": ..., "question_type": ...,
+                    "page_number": ..., "question_sum": ..., "choices": [...]}, ...]}
+
+The top level "choices" are used by every choice question that has none of
+its own.  import_survey creates the survey with bulk_create in one
+transaction, rendering the insertion into questions and choices in memory
+instead of in Question.save and Choice.save.  export_survey writes texts
+as written, with their placeholders.
+"""
+import json
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from assessment.models import Survey, SurveyImage, Question, Choice
+from assessment.survey_cache import invalidate_survey
+from assessment.templating import rendered
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+FORMATS = ('json', 'yaml')
+CHOICE_TYPES = (Question.TRUEFALSE, Question.MULTICHOICE, Question.MULTISELECT, Question.RANGE)
+SURVEY_FIELDS = ('name', 'description', 'insertion', 'external_survey_url', 'minutes_allowed', 'is_active')
+
+
+class SurveyFormatError(Exception):
+    pass
+
+
+def read_definition(data, format):
+    if format == 'json':
+        try:
+            definition = json.loads(data)
+        except ValueError as e:
+            raise SurveyFormatError('Invalid JSON: %s' % e)
+    elif format == 'yaml':
+        if yaml is None:
+            raise SurveyFormatError('Reading YAML requires PyYAML.')
+        try:
+            definition = yaml.safe_load(data)
+        except yaml.YAMLError as e:
+            raise SurveyFormatError('Invalid YAML: %s' % e)
+    else:
+        raise SurveyFormatError('Unknown format: %s' % format)
+    if not isinstance(definition, dict) or not definition.get('name'):
+        raise SurveyFormatError('Expected a survey object with a name.')
+    return definition
+
+
+def write_definition(definition, format):
+    if format == 'json':
+        return json.dumps(definition, indent=2)
+    if format == 'yaml':
+        if yaml is None:
+            raise SurveyFormatError('Writing YAML requires PyYAML.')
+        return yaml.safe_dump(definition, default_flow_style=False, allow_unicode=True)
+    raise SurveyFormatError('Unknown format: %s' % format)
+
+
+def checked_list(value, where):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise SurveyFormatError('%s: expected a list' % where)
+    return value
+
+
+def checked_text(value, where, field):
+    # YAML reads unquoted values such as 5 as numbers
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    if not isinstance(value, str):
+        raise SurveyFormatError('%s: %s must be text' % (where, field))
+    return value
+
+
+def checked_number(value, where, field, default):
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise SurveyFormatError('%s: %s must be a whole number' % (where, field))
+
+
+def checked_choices(items, where):
+    """
+    [{'choice_value': ..., 'weight': ...}, ...] of the choice items of a
+    definition, checked.
+    """
+    choices = []
+    for number, item in enumerate(checked_list(items, where), 1):
+        item_where = '%s, choice %s' % (where, number)
+        if not isinstance(item, dict):
+            raise SurveyFormatError('%s: expected an object' % item_where)
+        if 'choice_value' not in item:
+            raise SurveyFormatError('%s: missing choice_value' % item_where)
+        weight = item.get('weight', 0)
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+            raise SurveyFormatError('%s: weight must be a number' % item_where)
+        choices.append({'choice_value': checked_text(item['choice_value'], item_where, 'choice_value'),
+                        'weight': weight})
+    return choices
+
+
+def build_questions(definition, survey):
+    """
+    Unsaved Questions and, per question, its unsaved Choices.
+    """
+    default_choices = checked_choices(definition.get('choices'), 'Choices')
+    questions = []
+    choices = []
+    for number, item in enumerate(checked_list(definition.get('questions'), 'Questions'), 1):
+        where = 'Question %s' % number
+        if not isinstance(item, dict):
+            raise SurveyFormatError('%s: expected an object' % where)
+        try:
+            question_type = int(item.get('question_type', Question.MULTICHOICE))
+        except (TypeError, ValueError):
+            raise SurveyFormatError('%s: invalid question type' % where)
+        if question_type not in dict(Question.QUESTION_TYPE):
+            raise SurveyFormatError('%s: unknown question type %s' % (where, question_type))
+        text, template = rendered(checked_text(item.get('question', ''), where, 'question'), '', survey.insertion,
+                                  survey.insertion)
+        questions.append(Question(
+            survey=survey, question_type=question_type, question=text, question_template=template,
+            question_name=checked_text(item.get('question_name', ''), where, 'question_name'),
+            page_number=checked_number(item.get('page_number'), where, 'page_number', 1),
+            question_sum=checked_number(item.get('question_sum'), where, 'question_sum', 100)))
+        question_choices = item.get('choices')
+        if question_choices is None and question_type in CHOICE_TYPES:
+            question_choices = default_choices
+        else:
+            question_choices = checked_choices(question_choices, where)
+        choices.append([build_choice(choice, survey.insertion) for choice in question_choices])
+    return questions, choices
+
+
+def build_choice(item, insertion):
+    text, template = rendered(item['choice_value'], '', insertion, insertion)
+    return Choice(choice_value=text, choice_value_template=template, weight=item.get('weight', 0))
+
+
+def import_survey(definition):
+    """
+    Create the survey described by a definition with a fixed number of
+    queries and return it.
+    """
+    slug = slugify(definition['name'])
+    if Survey.objects.filter(slug=slug).exists():
+        raise SurveyFormatError('Survey "%s" already exists.' % slug)
+    images = [checked_text(image, 'Images', 'each image') for image in checked_list(definition.get('images'), 'Images')]
+    with transaction.atomic():
+        survey = Survey(**dict((field, definition[field]) for field in SURVEY_FIELDS if field in definition))
+        survey.save()
+        SurveyImage.objects.bulk_create([SurveyImage(survey=survey, image=image) for image in images])
+        questions, choices = build_questions(definition, survey)
+        Question.objects.bulk_create(questions)
+        # bulk_create does not return primary keys
+        question_ids = Question.objects.filter(survey=survey).order_by('id').values_list('id', flat=True)
+        new_choices = []
+        for question_id, question_choices in zip(question_ids, choices):
+            for choice in question_choices:
+                choice.question_id = question_id
+                new_choices.append(choice)
+        Choice.objects.bulk_create(new_choices)
+    # bulk_create sends no post_save, so the compiled survey is refreshed here.
+    invalidate_survey(survey.id)
+    return survey
+
+
+def export_survey(survey):
+    """
+    The definition of a survey, loading it with one prefetch.
+    """
+    survey = Survey.objects.prefetch_related('question_set__choice_set', 'images').get(pk=survey.pk)
+    definition = dict((field, getattr(survey, field)) for field in SURVEY_FIELDS)
+    # texts as written, so the placeholders survive a round trip
+    definition['description'] = survey.description_template or survey.description
+    definition['images'] = [image.image.name for image in survey.images.all()]
+    definition['questions'] = [{
+        'question': question.question_template or question.question,
+        'question_name': question.question_name,
+        'question_type': question.question_type,
+        'page_number': int(question.page_number),
+        'question_sum': question.question_sum,
+        'choices': [{'choice_value': choice.choice_value_template or choice.choice_value, 'weight': choice.weight}
+                    for choice in question.choice_set.all()],
+    } for question in survey.question_set.all()]
+    return definition
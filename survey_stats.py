@@ -0,0 +1,230 @@
+"""
+Per-survey score statistics.
+
+The cached aggregate of a survey is a frequency table of Result.total_score
+plus over-time counters.  It is built with one query on a cache miss and then
+updated in place as results are created (see the Result signal handlers in
+models.py), so page views only derive the statistics from the table with
+NumPy.  Scores are sums of choice weights and take few distinct values, so the
+table stays small however many results a survey has.
+
+Every change to a survey's results moves its generation counter on, and an
+aggregate is only used at the generation it was written for.  A new result is
+folded in after its transaction commits, and only into the aggregate of the
+previous generation; when updates race, the aggregate is left behind and the
+next read rebuilds it.  A rebuild is not cached if a new result was in flight
+while it ran, as it may or may not have counted it.  Aggregates expire after
+ASSESSMENT_STATS_TIMEOUT seconds whatever happens.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from assessment.models import Result
+
+
+STATS_TIMEOUT = getattr(settings, 'ASSESSMENT_STATS_TIMEOUT', 60 * 60)
+PENDING_TIMEOUT = 10 * 60
+
+STATS_KEY = 'assessment:survey-stats:%s'
+GENERATION_KEY = 'assessment:survey-stats:%s:generation'
+PENDING_KEY = 'assessment:survey-stats:%s:pending'
+PERCENTILES = (10, 25, 50, 75, 90)
+HISTOGRAM_BINS = 10
+
+_deferred = threading.local()
+
+
+def build_aggregate(survey_id):
+    rows = Result.objects.filter(survey_id=survey_id).values_list('total_score', 'excess_seconds')
+    aggregate = empty_aggregate()
+    for total_score, excess_seconds in rows.iterator():
+        add_to_aggregate(aggregate, total_score, excess_seconds)
+    return aggregate
+
+
+def empty_aggregate():
+    return {'counts': {}, 'over_time': 0, 'excess_seconds': 0, 'generation': None}
+
+
+def add_to_aggregate(aggregate, total_score, excess_seconds):
+    counts = aggregate['counts']
+    counts[total_score] = counts.get(total_score, 0) + 1
+    if excess_seconds > 0:
+        aggregate['over_time'] += 1
+        aggregate['excess_seconds'] += excess_seconds
+
+
+def next_generation(survey_id):
+    key = GENERATION_KEY % survey_id
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # a new or evicted counter starts where no cached aggregate can match
+        generation = int(time.time() * 1000000)
+        cache.set(key, generation, None)
+        return generation
+
+
+def get_aggregate(survey_id):
+    state = cache.get_many([STATS_KEY % survey_id, GENERATION_KEY % survey_id, PENDING_KEY % survey_id])
+    aggregate = state.get(STATS_KEY % survey_id)
+    generation = state.get(GENERATION_KEY % survey_id)
+    if generation is None:
+        generation = next_generation(survey_id)
+    elif aggregate is not None and aggregate['generation'] == generation:
+        return aggregate
+    aggregate = build_aggregate(survey_id)
+    aggregate['generation'] = generation
+    after = cache.get_many([GENERATION_KEY % survey_id, PENDING_KEY % survey_id])
+    quiet = all((counts.get(PENDING_KEY % survey_id) or 0) <= 0 for counts in (state, after))
+    if quiet and after.get(GENERATION_KEY % survey_id) == generation:
+        cache.set(STATS_KEY % survey_id, aggregate, STATS_TIMEOUT)
+    return aggregate
+
+
+def record_result(result):
+    """
+    Fold a committed result into the cached aggregate of its survey, if that
+    aggregate is at the generation just before this update.
+    """
+    generation = next_generation(result.survey_id)
+    aggregate = cache.get(STATS_KEY % result.survey_id)
+    if aggregate is None or aggregate['generation'] != generation - 1:
+        return
+    add_to_aggregate(aggregate, result.total_score, result.excess_seconds)
+    aggregate['generation'] = generation
+    cache.set(STATS_KEY % result.survey_id, aggregate, STATS_TIMEOUT)
+
+
+def invalidate(survey_id):
+    """
+    Make the next read rebuild the aggregate.  Call it after the change to the
+    survey's results has committed.
+    """
+    next_generation(survey_id)
+
+
+def result_adding(result):
+    """
+    Mark a new result of the survey as in flight until result_changed, or
+    the end of the survey_stats.atomic() block it is saved in.
+    """
+    key = PENDING_KEY % result.survey_id
+    cache.add(key, 0, PENDING_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, PENDING_TIMEOUT)
+
+
+def result_done(survey_id):
+    try:
+        cache.decr(PENDING_KEY % survey_id)
+    except ValueError:
+        pass
+
+
+def apply_change(result, created):
+    if created:
+        record_result(result)
+        result_done(result.survey_id)
+    else:
+        invalidate(result.survey_id)
+
+
+def result_changed(result, created=False):
+    events = getattr(_deferred, 'events', None)
+    if events is not None:
+        events.append((result, created))
+    elif transaction.get_connection().in_atomic_block:
+        # changed in a transaction whose commit cannot be seen from here
+        invalidate(result.survey_id)
+        if created:
+            result_done(result.survey_id)
+    else:
+        apply_change(result, created)
+
+
+@contextmanager
+def atomic():
+    """
+    transaction.atomic() that updates the statistics of the results saved in
+    it once the transaction has committed, and not at all if it rolls back.
+    """
+    if getattr(_deferred, 'events', None) is not None:
+        with transaction.atomic():
+            yield
+        return
+    _deferred.events = events = []
+    try:
+        with transaction.atomic():
+            yield
+    except:
+        for result, created in events:
+            if created:
+                result_done(result.survey_id)
+        raise
+    finally:
+        _deferred.events = None
+    committed = not transaction.get_connection().in_atomic_block
+    for result, created in events:
+        if committed:
+            apply_change(result, created)
+        else:
+            # an outer transaction is still open
+            invalidate(result.survey_id)
+            if created:
+                result_done(result.survey_id)
+
+
+def survey_statistics(survey_id):
+    """
+    Count, mean, sample standard deviation, percentiles, histogram and
+    over-time counts of a survey's scores.
+    """
+    aggregate = get_aggregate(survey_id)
+    scores = sorted(aggregate['counts'])
+    count = sum(aggregate['counts'].values())
+    stats = {
+        'count': count,
+        'over_time': aggregate['over_time'],
+        'over_time_share': float(aggregate['over_time']) / count if count else 0,
+        'mean_excess_seconds': float(aggregate['excess_seconds']) / aggregate['over_time'] if aggregate['over_time'] else 0,
+    }
+    if not count:
+        return stats
+    values = numpy.array(scores, dtype=float)
+    weights = numpy.array([aggregate['counts'][score] for score in scores], dtype=float)
+    mean = numpy.average(values, weights=weights)
+    variance = numpy.sum(weights * (values - mean) ** 2) / (count - 1) if count > 1 else 0.0
+    histogram, edges = numpy.histogram(values, bins=HISTOGRAM_BINS, weights=weights)
+    stats.update({
+        'mean': float(mean),
+        'std': float(numpy.sqrt(variance)),
+        'min': float(values[0]),
+        'max': float(values[-1]),
+        'percentiles': list(zip(PERCENTILES, weighted_percentiles(values, weights, PERCENTILES))),
+        'histogram': [(float(edges[i]), float(edges[i + 1]), int(histogram[i])) for i in range(len(histogram))],
+    })
+    return stats
+
+
+def weighted_percentiles(values, weights, percentiles):
+    """
+    Linearly interpolated percentiles of the sorted values repeated weights
+    times, without expanding them.
+    """
+    cumulative = numpy.cumsum(weights)
+    ranks = numpy.array(percentiles, dtype=float) / 100 * (cumulative[-1] - 1)
+    lower = numpy.floor(ranks)
+    upper = numpy.ceil(ranks)
+    lower_values = values[numpy.searchsorted(cumulative, lower, side='right')]
+    upper_values = values[numpy.searchsorted(cumulative, upper, side='right')]
+    return [float(value) for value in lower_values + (upper_values - lower_values) * (ranks - lower)]
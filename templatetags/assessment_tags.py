@@ -1,7 +1,14 @@
 from django import template
 
+from assessment.fragments import question_fragments as render_question_fragments
+
 register = template.Library()
 
 @register.filter(is_safe=True)
 def create_range(value):
     return range(1, value+1)        # returns a list containing range made from given value in template
+
+
+@register.assignment_tag
+def question_fragments(form):
+    return render_question_fragments(form)
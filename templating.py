@@ -0,0 +1,93 @@
+"""
+Insertion templating of survey texts.
+
+Survey descriptions, questions and choices may contain %s placeholders that
+are filled with Survey.insertion (e.g. the client's company name) when they
+are saved; %% stands for a literal %.  Texts are stored rendered, next to the
+text as written (the description_template, question_template and
+choice_value_template fields, empty for texts without placeholders).  When the
+insertion of a survey changes, rerender_survey renders all of the survey's
+questions and choices again from their templates with one UPDATE per table.
+"""
+import re
+
+from django.db import connection
+
+from assessment.models import Question, Choice
+
+
+PLACEHOLDER = re.compile(r'%([s%])')
+# stands in for an escaped %% while the SQL fills in the placeholders
+ESCAPE_MARK = '\x01'
+
+
+def has_placeholders(text):
+    return bool(text) and PLACEHOLDER.search(text) is not None
+
+
+def render(text, insertion):
+    """
+    text with every placeholder substituted in a single pass.  Without an
+    insertion, text is left as is so it can be filled in later.
+    """
+    if not insertion or not text:
+        return text
+    return PLACEHOLDER.sub(lambda match: insertion if match.group(1) == 's' else '%', text)
+
+
+def rendered(text, template, insertion, previous_insertion):
+    """
+    The (text, template) pair to store for a text saved with insertion.  A
+    text with placeholders is the new template.  A text that is still the
+    rendering of its template for previous_insertion is rendered again;
+    anything else was edited by hand and is no longer templated.
+    """
+    if has_placeholders(text):
+        return render(text, insertion), text
+    if template and text == render(template, previous_insertion):
+        return render(template, insertion), template
+    return text, ''
+
+
+def template_pattern(template):
+    """
+    Regular expression source matching template rendered with any
+    non-empty insertion.
+    """
+    parts = []
+    position = 0
+    for match in PLACEHOLDER.finditer(template):
+        parts.append(re.escape(template[position:match.start()]))
+        parts.append('.+?' if match.group(1) == 's' else '%')
+        position = match.end()
+    parts.append(re.escape(template[position:]))
+    return ''.join(parts)
+
+
+def sql_render(column, insertion):
+    """
+    SQL rendering the template in column the way render() does, and its
+    parameters.
+    """
+    if not insertion:
+        return column, []
+    return ('REPLACE(REPLACE(REPLACE(%s, %%s, %%s), %%s, %%s), %%s, %%s)' % column,
+            ['%%', ESCAPE_MARK, '%s', insertion, ESCAPE_MARK, '%'])
+
+
+def rerender_survey(survey_id, insertion):
+    """
+    Render the templated questions and choices of a survey for a new
+    insertion.
+    """
+    question_table = connection.ops.quote_name(Question._meta.db_table)
+    choice_table = connection.ops.quote_name(Choice._meta.db_table)
+    updates = [('question', question_table, 'survey_id = %s'),
+               ('choice_value', choice_table,
+                'question_id IN (SELECT id FROM %s WHERE survey_id = %%s)' % question_table)]
+    cursor = connection.cursor()
+    for column, table, where in updates:
+        template = connection.ops.quote_name(column + '_template')
+        expression, params = sql_render(template, insertion)
+        cursor.execute("UPDATE %s SET %s = %s WHERE %s AND %s <> ''" % (
+            table, connection.ops.quote_name(column), expression, where, template), params + [survey_id])
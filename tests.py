@@ -1,3 +1,795 @@
-from django.test import TestCase
+import datetime
+import json
+import tempfile
+import threading
+import time
+from io import StringIO
 
-# Create your tests here.
+import numpy
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.forms.forms import BoundField
+from django.db import connection
+from django.template.loader import render_to_string
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from assessment import survey_stats
+from assessment.drafts import get_draft, save_changes
+from assessment.models import (Survey, Question, Choice, Result, Answer, Attempt, Available, UserProfile,
+                               ItemAnalysis)
+from assessment.survey_cache import CompiledSurvey, CompiledQuestion, CompiledChoice, get_compiled_survey
+from assessment.survey_forms import ResultCreateForm
+from assessment.templating import render
+from assessment.benchmarks import generate_data, run_benchmarks
+from assessment.candidates import read_candidates, validate_candidates
+from assessment.exports import export_results
+from assessment.item_analysis import empty_accumulators, fold, derive
+from assessment.urls import urlpatterns
+from assessment.perf import QueryBudgetMixin, duplicated_shapes, query_shape
+from assessment.tokens import make_login_token, revoke_login_tokens
+
+
+def make_compiled_survey(question_count, choice_count=5):
+    """
+    An in-memory CompiledSurvey of multiple choice questions whose names
+    deliberately contain each other ("Q1" is a substring of "Q10").
+    """
+    questions = []
+    choices_by_id = {}
+    weights = {}
+    for i in range(question_count):
+        question_id = i + 1
+        choices = []
+        for j in range(choice_count):
+            choice = CompiledChoice(question_id * 100 + j, 'Choice %s' % j, j, None)
+            choices.append(choice)
+            choices_by_id[choice.id] = choice
+            weights[choice.id] = choice.weight
+        questions.append(CompiledQuestion(question_id, 'Q%s' % question_id, 'Question number %s' % question_id,
+                                          Question.MULTICHOICE, 1, 100, str(question_id), tuple(choices)))
+    return CompiledSurvey(1, 'Benchmark', 'benchmark', '', '', '', 0, True, (), tuple(questions),
+                          choices_by_id, weights, 'benchmark')
+
+
+class SurveyRenderBenchmark(SimpleTestCase):
+
+    def bound_fields_built(self, question_count):
+        """
+        BoundFields built while rendering a survey, with no fragment cached.
+        """
+        survey = make_compiled_survey(question_count)
+        form = ResultCreateForm(survey, None, None)
+        built = []
+        init = BoundField.__init__
+
+        def counting_init(bound_field, *args, **kwargs):
+            built.append(bound_field)
+            init(bound_field, *args, **kwargs)
+        cache.clear()
+        BoundField.__init__ = counting_init
+        try:
+            render_to_string('assessment/base_survey.html', {'form': form, 'survey': survey, 'seconds_allowed': 0})
+        finally:
+            BoundField.__init__ = init
+        return len(built)
+
+    def test_each_field_rendered_once(self):
+        survey = make_compiled_survey(12)
+        form = ResultCreateForm(survey, None, None)
+        html = render_to_string('assessment/base_survey.html', {'form': form, 'survey': survey})
+        for question in survey.questions:
+            self.assertEqual(html.count('name="%s"' % question.field_key), len(question.choices))
+
+    def test_cached_fragments_do_not_leak_answers(self):
+        survey = make_compiled_survey(3)
+        html = render_to_string('assessment/base_survey.html', {'form': ResultCreateForm(survey, None, None),
+                                                                'survey': survey})
+        self.assertNotIn('checked="checked"', html)
+        question = survey.questions[0]
+        form = ResultCreateForm(survey, None, None, initial={question.field_key: question.choices[1].id})
+        html = render_to_string('assessment/base_survey.html', {'form': form, 'survey': survey})
+        self.assertEqual(html.count('checked="checked"'), 1)
+
+    def test_render_work_grows_linearly(self):
+        small, large = self.bound_fields_built(20), self.bound_fields_built(80)
+        self.assertGreaterEqual(small, 20)
+        # scanning every field for each question would build 16 times as many
+        self.assertEqual(large, small * 4)
+
+
+def create_survey(name, question_count, choice_count=5):
+    survey = Survey.objects.create(name=name, description='')
+    for i in range(question_count):
+        question = Question.objects.create(survey=survey, question_name='Q%s' % i, question='Question %s' % i,
+                                           question_type=Question.MULTICHOICE)
+        for j in range(choice_count):
+            Choice.objects.create(question=question, choice_value='Choice %s' % j, weight=j)
+    return survey
+
+
+class ResultSubmissionTest(TestCase):
+
+    def login(self, survey, assigned=True):
+        user = User.objects.create(username='candidate')
+        user.set_password('candidate')
+        user.save()
+        if assigned:
+            Available.objects.create(user=user, survey=survey, url='')
+        self.client.login(username='candidate', password='candidate')
+        return user
+
+    def submit(self, survey, user):
+        compiled = get_compiled_survey(survey.id)
+        data = dict((question.field_key, str(question.choices[-1].id)) for question in compiled.questions)
+        form = ResultCreateForm(compiled, user, datetime.datetime.now(), data=data)
+        self.assertTrue(form.is_valid(), form.errors)
+        with CaptureQueriesContext(connection) as queries:
+            result = form.save()
+        return result, len(queries)
+
+    def test_submission_query_count_is_independent_of_survey_size(self):
+        user = User.objects.create(username='candidate')
+        small, small_queries = self.submit(create_survey('Small', 5), user)
+        large, large_queries = self.submit(create_survey('Large', 60), user)
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(Answer.objects.filter(result=small).count(), 5)
+        self.assertEqual(Answer.objects.filter(result=large).count(), 60)
+        self.assertEqual(large.total_score, 60 * 4)
+
+    def test_unassigned_survey_cannot_be_posted(self):
+        survey = create_survey('Unassigned', 1)
+        user = self.login(survey, assigned=False)
+        question = get_compiled_survey(survey.id).questions[0]
+        response = self.client.post(reverse('assessment:assessment_survey', args=(survey.slug,)),
+                                    {'page': '1', 'finish': 'Finish', question.field_key: str(question.choices[0].id)})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith(reverse('assessment:assessment_surveys')))
+        self.assertFalse(Attempt.objects.filter(user=user).exists())
+        self.assertFalse(Result.objects.filter(user=user).exists())
+
+    def paged_survey(self):
+        """
+        A survey of three questions, one per page, and its URL.
+        """
+        survey = create_survey('Paged', 3)
+        for page_number, name in enumerate(('Q0', 'Q1', 'Q2'), 1):
+            Question.objects.filter(survey=survey, question_name=name).update(page_number=page_number)
+        return survey, reverse('assessment:assessment_survey', args=(survey.slug,))
+
+    def post_page(self, url, page_number, button, answers=None):
+        data = {'page': str(page_number), button: button}
+        data.update(dict((question.field_key, str(question.choices[choice].id))
+                         for question, choice in (answers or {}).items()))
+        return self.client.post(url, data)
+
+    def stored_answers(self, user):
+        return dict(Answer.objects.filter(result__user=user).values_list('question__question_name', 'answer'))
+
+    def test_pages_carry_answers_in_the_draft(self):
+        survey, url = self.paged_survey()
+        user = self.login(survey)
+        first, second, third = get_compiled_survey(survey.id).questions
+        response = self.post_page(url, 1, 'next', {first: 1})
+        self.assertTrue(response['Location'].endswith('%s?page=2' % url))
+        response = self.post_page(url, 2, 'previous', {second: 2})
+        self.assertTrue(response['Location'].endswith('%s?page=1' % url))
+        page = self.client.get(url + '?page=1')
+        self.assertContains(page, 'name="%s"' % first.field_key)
+        self.assertNotContains(page, 'name="%s"' % second.field_key)
+        self.assertContains(page, 'checked="checked"', count=1)
+        # the answers of the other pages come from the draft, not the POST
+        self.post_page(url, 1, 'next')
+        self.post_page(url, 2, 'next')
+        response = self.post_page(url, 3, 'finish', {third: 3})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stored_answers(user), {'Q0': 'Choice 1', 'Q1': 'Choice 2', 'Q2': 'Choice 3'})
+        self.assertEqual(get_draft(user.id, survey.id), {})
+
+    def test_finish_from_a_middle_page_submits_every_page(self):
+        survey, url = self.paged_survey()
+        user = self.login(survey)
+        first, second, third = get_compiled_survey(survey.id).questions
+        save_changes(user.id, survey.id, {first.field_key: str(first.choices[4].id),
+                                          third.field_key: str(third.choices[0].id)})
+        response = self.post_page(url, 2, 'finish', {second: 1})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stored_answers(user), {'Q0': 'Choice 4', 'Q1': 'Choice 1', 'Q2': 'Choice 0'})
+        self.assertIsNotNone(Attempt.objects.get(user=user, survey=survey).finished_on)
+
+    def test_invalid_survey_on_finish_is_shown_on_one_page(self):
+        survey, url = self.paged_survey()
+        user = self.login(survey)
+        first, second, third = get_compiled_survey(survey.id).questions
+        # autosaves are not validated: a choice deleted since it was saved
+        save_changes(user.id, survey.id, {third.field_key: '999999'})
+        response = self.post_page(url, 2, 'finish', {second: 1})
+        self.assertEqual(response.status_code, 200)
+        for question in (first, second, third):
+            self.assertContains(response, 'name="%s"' % question.field_key)
+        self.assertNotContains(response, 'name="page"')
+        self.assertFalse(Result.objects.filter(user=user).exists())
+        # correcting it on that page submits
+        response = self.client.post(url, {'finish': 'Finish', second.field_key: str(second.choices[1].id),
+                                          third.field_key: str(third.choices[2].id)})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stored_answers(user), {'Q0': 'No Response', 'Q1': 'Choice 1', 'Q2': 'Choice 2'})
+
+    def test_answers_use_database_keys(self):
+        user = User.objects.create(username='candidate')
+        survey = create_survey('Survey', 3)
+        result, _ = self.submit(survey, user)
+        compiled = get_compiled_survey(survey.id)
+        question_ids = list(Question.objects.filter(survey=survey).order_by('id').values_list('id', flat=True))
+        self.assertEqual([question.id for question in compiled.questions], question_ids)
+        # submit picks the last choice of every question
+        chosen = dict((question.id, question.choices[-1]) for question in compiled.questions)
+        for question_id, choice in chosen.items():
+            self.assertEqual(Choice.objects.get(pk=choice.id).question_id, question_id)
+        answers = Answer.objects.filter(result=result).order_by('question').values_list('question_id', 'answer')
+        self.assertEqual(list(answers),
+                         [(question_id, chosen[question_id].choice_value) for question_id in question_ids])
+        self.assertEqual(Choice.objects.get(pk=chosen[question_ids[0]].id).choice_value, 'Choice 4')
+
+
+class BenchmarkSuiteTest(TestCase):
+
+    def test_generate_data(self):
+        data = generate_data(users=4, surveys=2, questions=3, results=5)
+        self.assertEqual(Survey.objects.count(), 2)
+        self.assertEqual(Question.objects.count(), 6)
+        self.assertEqual(Result.objects.count(), 5)
+        self.assertEqual(Answer.objects.count(), 15)
+        self.assertFalse(Result.objects.filter(user=data.candidate, survey=data.open_survey).exists())
+
+    def test_every_url_is_benchmarked(self):
+        records = run_benchmarks(generate_data(users=3, surveys=2, questions=3, results=4), repeat=1)
+        names = set(record['name'] for record in records)
+        for pattern in urlpatterns:
+            self.assertIn('url:%s' % pattern.name, names)
+        self.assertIn('form:ResultCreateForm.save', names)
+        self.assertIn('admin:SurveyAdmin.duplicate', names)
+        for record in records:
+            self.assertLess(record['status'], 500, record)
+
+
+class QueryShapeTest(SimpleTestCase):
+
+    def test_parameters_are_ignored(self):
+        self.assertEqual(query_shape("SELECT * FROM t WHERE id = 1 AND name = 'a'"),
+                         query_shape("SELECT * FROM t WHERE id = 22 AND name = 'b'"))
+        self.assertEqual(query_shape('SELECT * FROM t WHERE id IN (1, 2, 3)'),
+                         query_shape('SELECT * FROM t WHERE id IN (4, 5)'))
+
+    def test_duplicated_shapes(self):
+        queries = [{'sql': 'SELECT * FROM t WHERE id = %s' % i} for i in range(3)] + [{'sql': 'SELECT 1'}]
+        self.assertEqual(duplicated_shapes(queries), [('SELECT * FROM t WHERE id = ?', 3)])
+
+
+class ViewQueryBudgetTest(QueryBudgetMixin, TestCase):
+
+    def test_user_results_budget(self):
+        for size in (1, 20):
+            data = generate_data(users=2, surveys=size, questions=5, results=2 * size)
+            self.client.login(username=data.staff.username, password='benchmark')
+            with self.assertQueryBudget(12):
+                self.client.get(reverse('assessment:assessment_results', args=(data.candidate.id,)))
+            Survey.objects.all().delete()
+            User.objects.all().delete()
+
+    def test_result_detail_budget(self):
+        for questions in (5, 50):
+            data = generate_data(users=2, surveys=1, questions=questions, results=1)
+            self.client.login(username=data.staff.username, password='benchmark')
+            with self.assertQueryBudget(10):
+                self.client.get(reverse('assessment:survey_results', args=(data.result_id,)))
+            Survey.objects.all().delete()
+            User.objects.all().delete()
+
+
+def create_result(survey, user, total_score, excess_seconds=0):
+    return Result.objects.create(survey=survey, user=user, started_on=datetime.datetime.now(),
+                                 score='%s' % total_score, total_score=total_score, excess_seconds=excess_seconds)
+
+
+class SurveyStatisticsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.survey = create_survey('Statistics', 1)
+        create_result(self.survey, User.objects.create(username='first'), 2)
+
+    def test_late_write_of_a_stale_aggregate_is_not_used(self):
+        stale = survey_stats.get_aggregate(self.survey.id)
+        create_result(self.survey, User.objects.create(username='second'), 3)
+        # an update that started before the new result writes back last
+        cache.set(survey_stats.STATS_KEY % self.survey.id, stale)
+        self.assertEqual(survey_stats.survey_statistics(self.survey.id)['count'], 2)
+
+    def test_rebuild_racing_a_new_result_is_not_cached(self):
+        survey_stats.result_adding(Result(survey_id=self.survey.id))
+        self.assertEqual(survey_stats.get_aggregate(self.survey.id)['counts'], {2: 1})
+        with self.assertNumQueries(1):
+            survey_stats.get_aggregate(self.survey.id)
+        survey_stats.result_done(self.survey.id)
+        survey_stats.get_aggregate(self.survey.id)
+        with self.assertNumQueries(0):
+            survey_stats.get_aggregate(self.survey.id)
+
+
+class SurveyStatisticsCommitTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.survey = create_survey('Statistics', 1)
+        create_result(self.survey, User.objects.create(username='first'), 2)
+        survey_stats.get_aggregate(self.survey.id)
+
+    def test_result_is_recorded_after_commit(self):
+        with survey_stats.atomic():
+            create_result(self.survey, User.objects.create(username='second'), 4, excess_seconds=30)
+            self.assertEqual(cache.get(survey_stats.STATS_KEY % self.survey.id)['counts'], {2: 1})
+        with self.assertNumQueries(0):
+            stats = survey_stats.survey_statistics(self.survey.id)
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['mean'], 3)
+        self.assertEqual(stats['over_time'], 1)
+
+    def test_rolled_back_result_is_not_recorded(self):
+        with self.assertRaises(ValueError):
+            with survey_stats.atomic():
+                create_result(self.survey, User.objects.create(username='second'), 4)
+                raise ValueError
+        self.assertEqual(survey_stats.survey_statistics(self.survey.id)['count'], 1)
+        with self.assertNumQueries(0):
+            survey_stats.get_aggregate(self.survey.id)
+
+    def test_result_saved_outside_a_transaction_is_folded_in(self):
+        create_result(self.survey, User.objects.create(username='second'), 4)
+        with self.assertNumQueries(0):
+            self.assertEqual(survey_stats.get_aggregate(self.survey.id)['counts'], {2: 1, 4: 1})
+
+
+class LoginTokenTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='candidate')
+
+    def authenticate(self, token):
+        response = self.client.get(reverse('assessment:assessment_authenticate', args=(token,)))
+        self.client.logout()
+        return response.status_code
+
+    def test_revoked_links_fail(self):
+        token = make_login_token(self.user.id)
+        profile_token = UserProfile.objects.get(user=self.user).profile_token
+        self.assertEqual(self.authenticate(token), 302)
+        self.assertEqual(self.authenticate(profile_token), 302)
+        revoke_login_tokens(self.user.id)
+        self.assertEqual(self.authenticate(token), 404)
+        self.assertEqual(self.authenticate(profile_token), 404)
+        self.assertEqual(self.authenticate(make_login_token(self.user.id)), 302)
+
+    def test_revoking_requires_a_post_with_csrf_token(self):
+        from django.test import Client
+        token = make_login_token(self.user.id)
+        staff = User.objects.create(username='staff', is_staff=True)
+        staff.set_password('staff')
+        staff.save()
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='staff', password='staff')
+        url = reverse('assessment:assessment_revoketokens', args=(self.user.id,))
+        self.assertEqual(client.get(url).status_code, 405)
+        self.assertEqual(client.post(url).status_code, 403)
+        self.assertEqual(self.authenticate(token), 302)
+        page = client.get(reverse('assessment:assessment_results', args=(self.user.id,)))
+        self.assertContains(page, 'action="%s" method="post"' % url)
+        self.assertEqual(client.post(url, {'csrfmiddlewaretoken': client.cookies['csrftoken'].value}).status_code,
+                         302)
+        self.assertEqual(self.authenticate(token), 404)
+
+
+class InsertionTemplateTest(TestCase):
+
+    TEMPLATES = ['Does %s pay 100%% of %s?', '%%s is literal', '%%%s', '50%% off', 'No placeholders, 1 Acme']
+
+    def setUp(self):
+        self.survey = Survey.objects.create(name='Branded', description='About %s', insertion='Acme')
+        self.questions = [Question.objects.create(survey=self.survey, question=text, question_name='Acme')
+                          for text in self.TEMPLATES]
+        self.choices = [Choice.objects.create(question=self.questions[0], choice_value=text)
+                        for text in self.TEMPLATES]
+
+    def assertRenderedFor(self, insertion):
+        self.assertEqual(Survey.objects.get(pk=self.survey.pk).description, 'About %s' % insertion)
+        questions = Question.objects.filter(survey=self.survey).order_by('id').values_list('question', flat=True)
+        choices = Choice.objects.filter(question=self.questions[0]).order_by('id').values_list(
+            'choice_value', flat=True)
+        expected = [render(text, insertion) for text in self.TEMPLATES[:-1]] + [self.TEMPLATES[-1]]
+        self.assertEqual(list(questions), expected)
+        self.assertEqual(list(choices), expected)
+
+    def test_texts_are_rendered_on_save(self):
+        self.assertRenderedFor('Acme')
+        self.assertEqual(Question.objects.get(pk=self.questions[0].pk).question, 'Does Acme pay 100% of Acme?')
+
+    def test_changing_the_insertion_renders_from_the_templates(self):
+        self.survey.insertion = '1'
+        self.survey.save()
+        self.assertRenderedFor('1')
+        survey = Survey.objects.get(pk=self.survey.pk)
+        survey.insertion = 'Initech'
+        survey.save()
+        self.assertRenderedFor('Initech')
+
+    def test_text_edited_by_hand_is_no_longer_templated(self):
+        question = Question.objects.get(pk=self.questions[0].pk)
+        question.question = 'Does Acme pay?'
+        question.save()
+        self.survey.insertion = 'Initech'
+        self.survey.save()
+        self.assertEqual(Question.objects.get(pk=question.pk).question, 'Does Acme pay?')
+
+
+class RescoreCommandTest(TestCase):
+
+    def test_scores_and_snapshots_are_written_per_chunk(self):
+        survey = create_survey('Rescore', 2)
+        compiled = get_compiled_survey(survey.id)
+        data = dict((question.field_key, str(question.choices[-1].id)) for question in compiled.questions)
+        for i in range(5):
+            form = ResultCreateForm(compiled, User.objects.create(username='candidate%s' % i),
+                                    datetime.datetime.now(), data=data)
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+        Choice.objects.filter(question__survey=survey, weight=4).update(weight=10)
+        # the answers record their choice ids, so text shared by every choice does not matter
+        Choice.objects.filter(question__survey=survey).update(choice_value='Same')
+        with CaptureQueriesContext(connection) as queries:
+            call_command('rescore', survey.slug, workers=2, verbosity=0, stdout=StringIO())
+        updates = [query['sql'] for query in queries if 'UPDATE "assessment_result"' in query['sql']]
+        # one UPDATE for the single new score and one for the five snapshots
+        self.assertEqual(len(updates), 2, updates)
+        for result in Result.objects.filter(survey=survey):
+            self.assertEqual(result.total_score, 20)
+            self.assertEqual([row['score'] for row in result.get_snapshot()], [10, 10])
+
+    def test_text_answers_resolve_through_templates_or_are_left_unchanged(self):
+        survey = Survey.objects.create(name='Legacy', description='', insertion='Acme')
+        single = Question.objects.create(survey=survey, question_name='single', question='Pick one',
+                                         question_type=Question.MULTICHOICE)
+        Choice.objects.create(question=single, choice_value='%s rocks', weight=3)
+        Choice.objects.create(question=single, choice_value='Other', weight=1)
+        multiple = Question.objects.create(survey=survey, question_name='multiple', question='Pick some',
+                                           question_type=Question.MULTISELECT)
+        for value, weight in (('Red, white', 2), ('Red', 5), ('Blue', 7)):
+            Choice.objects.create(question=multiple, choice_value=value, weight=weight)
+        # answers stored before choice ids were recorded
+        resolved = create_result(survey, User.objects.create(username='resolved'), 0)
+        Answer.objects.create(result=resolved, question=single, answer='Acme rocks')
+        Answer.objects.create(result=resolved, question=multiple, answer='Red, white, Blue')
+        unmatched = create_result(survey, User.objects.create(username='unmatched'), 99)
+        Answer.objects.create(result=unmatched, question=single, answer='A choice since deleted')
+        Answer.objects.create(result=unmatched, question=multiple, answer='Red')
+        survey.insertion = 'Bolt'
+        survey.save()
+        stderr = StringIO()
+        call_command('rescore', survey.slug, workers=1, verbosity=0, stdout=StringIO(), stderr=stderr)
+        self.assertEqual(Result.objects.get(pk=resolved.pk).total_score, 12)
+        self.assertEqual(Result.objects.get(pk=unmatched.pk).total_score, 99)
+        self.assertIn('Left 1 results unchanged', stderr.getvalue())
+        self.assertIn(str(unmatched.pk), stderr.getvalue())
+
+
+class CandidateImportTest(TestCase):
+
+    CSV = 'email,first_name,last_name,surveys\n%s,Jane,Doe,%s\n'
+
+    def setUp(self):
+        self.survey = create_survey('Intake', 1)
+
+    def test_survey_listed_twice_is_rejected(self):
+        candidates = read_candidates(self.CSV % ('jane@example.com', 'intake;intake=http://example.com'), 'csv')
+        self.assertEqual(validate_candidates(candidates), ['Row 1: survey "intake" is listed more than once'])
+
+    def test_existing_username_is_matched_case_insensitively(self):
+        User.objects.create(username='Jane@Example.com')
+        candidates = read_candidates(self.CSV % ('jane@example.com', 'intake'), 'csv')
+        self.assertEqual(validate_candidates(candidates), ['User Jane@Example.com already exists'])
+
+    def test_view_imports_candidates(self):
+        staff = User.objects.create(username='staff', is_staff=True)
+        staff.set_password('staff')
+        staff.save()
+        self.client.login(username='staff', password='staff')
+        upload = SimpleUploadedFile('candidates.csv', (self.CSV % ('jane@example.com', 'intake')).encode('utf-8'))
+        response = self.client.post(reverse('assessment:assessment_import'), {'candidates': upload})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        user = User.objects.get(username='jane@example.com')
+        self.assertTrue(user.available_set.filter(survey=self.survey).exists())
+
+    def test_view_sends_files_with_many_passwords_to_the_command(self):
+        from assessment.candidates import WEB_IMPORT_MAX_PASSWORDS
+        staff = User.objects.create(username='staff', is_staff=True)
+        staff.set_password('staff')
+        staff.save()
+        self.client.login(username='staff', password='staff')
+        rows = ''.join('candidate%s@example.com,Jane,Doe,secret,intake\n' % i
+                       for i in range(WEB_IMPORT_MAX_PASSWORDS + 1))
+        upload = SimpleUploadedFile('candidates.csv', ('email,first_name,last_name,password,surveys\n' +
+                                                       rows).encode('utf-8'))
+        response = self.client.post(reverse('assessment:assessment_import'), {'candidates': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'manage.py import_candidates')
+        self.assertFalse(User.objects.filter(username__startswith='candidate').exists())
+
+
+class ItemAnalysisTest(TestCase):
+
+    MATRIX = numpy.array([[1, 2, 3, 1], [2, 2, 4, 0], [3, 3, 3, 1], [4, 5, 5, 1], [2, 1, 2, 0], [0, 1, 1, 0]],
+                         dtype=float)
+
+    def derived(self, chunks):
+        accumulators = empty_accumulators(list(range(self.MATRIX.shape[1])), '')
+        for chunk in chunks:
+            fold(accumulators, chunk, [{} for _ in range(chunk.shape[1])])
+        return derive(accumulators)
+
+    def test_alpha_and_corrected_item_total_correlations(self):
+        means, deviations, correlations, alpha = self.derived([self.MATRIX])
+        items = self.MATRIX.shape[1]
+        totals = self.MATRIX.sum(axis=1)
+        expected_alpha = items / (items - 1.0) * (1 - self.MATRIX.var(axis=0, ddof=1).sum() / totals.var(ddof=1))
+        self.assertAlmostEqual(alpha, expected_alpha)
+        self.assertAlmostEqual(alpha, 0.8903878583)
+        for i in range(items):
+            rest = totals - self.MATRIX[:, i]
+            self.assertAlmostEqual(correlations[i], numpy.corrcoef(self.MATRIX[:, i], rest)[0, 1])
+        numpy.testing.assert_allclose(means, self.MATRIX.mean(axis=0))
+        numpy.testing.assert_allclose(deviations, self.MATRIX.std(axis=0, ddof=1))
+
+    def test_folding_chunks_matches_one_pass(self):
+        whole = self.derived([self.MATRIX])
+        chunked = self.derived([self.MATRIX[:2], self.MATRIX[2:5], self.MATRIX[5:]])
+        self.assertAlmostEqual(whole[3], chunked[3])
+        numpy.testing.assert_allclose(whole[2], chunked[2])
+
+    def test_sweeper_refreshes_and_submissions_and_the_page_only_read(self):
+        survey = create_survey('Items', 3)
+        compiled = get_compiled_survey(survey.id)
+        for i, pick in enumerate((0, 2, 4)):
+            data = dict((question.field_key, str(question.choices[pick].id)) for question in compiled.questions)
+            form = ResultCreateForm(compiled, User.objects.create(username='candidate%s' % i),
+                                    datetime.datetime.now(), data=data)
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+        self.assertFalse(ItemAnalysis.objects.filter(survey=survey).exists())
+        call_command('sweep_attempts', stdout=StringIO())
+        analysis = ItemAnalysis.objects.get(survey=survey)
+        self.assertEqual(analysis.respondents, 3)
+        self.assertAlmostEqual(analysis.alpha, 1.0)
+        staff = User.objects.create(username='staff', is_staff=True)
+        staff.set_password('staff')
+        staff.save()
+        self.client.login(username='staff', password='staff')
+        other = create_survey('No results', 1)
+        url = reverse('assessment:survey_result_statistics', args=(other.slug,))
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse(ItemAnalysis.objects.filter(survey=other).exists())
+        # nothing changed since the sweep
+        with CaptureQueriesContext(connection) as queries:
+            call_command('item_analysis', stdout=StringIO())
+        self.assertFalse(any('UPDATE ' in query['sql'] for query in queries.captured_queries))
+        Result.objects.filter(survey=survey).order_by('id')[0].delete()
+        call_command('item_analysis', stdout=StringIO())
+        self.assertEqual(ItemAnalysis.objects.get(survey=survey).respondents, 2)
+
+
+class ExportTest(TestCase):
+
+    def test_wide_jsonl_keeps_answers_of_questions_sharing_a_name(self):
+        survey = create_survey('Export', 3)
+        Question.objects.filter(survey=survey).update(question_name='Q')
+        compiled = get_compiled_survey(survey.id)
+        data = dict((question.field_key, str(question.choices[i].id)) for i, question in enumerate(compiled.questions))
+        form = ResultCreateForm(compiled, User.objects.create(username='candidate'), datetime.datetime.now(), data=data)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        lines = list(export_results(compiled, layout='wide', format='jsonl'))
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual([row['Q_%s' % question.id] for question in compiled.questions],
+                         ['Choice 0', 'Choice 1', 'Choice 2'])
+
+
+class FinalizeExpiredTest(TestCase):
+
+    def test_submission_racing_the_sweeper_keeps_the_rest_of_the_batch(self):
+        from assessment import attempts
+        survey = create_survey('Sweep', 2)
+        started_on = datetime.datetime.now() - datetime.timedelta(hours=2)
+        users = [User.objects.create(username='candidate%s' % i) for i in range(3)]
+        for user in users:
+            Attempt.objects.create(user=user, survey=survey, started_on=started_on,
+                                   deadline=started_on + datetime.timedelta(minutes=30))
+        get_drafts = attempts.get_drafts
+
+        def submit_meanwhile(pairs):
+            # the first candidate submits after the sweeper looked for results
+            create_result(survey, users[0], 7)
+            return get_drafts(pairs)
+        attempts.get_drafts = submit_meanwhile
+        try:
+            self.assertEqual(attempts.finalize_expired(), 2)
+        finally:
+            attempts.get_drafts = get_drafts
+        self.assertEqual(Result.objects.get(user=users[0]).total_score, 7)
+        self.assertEqual(Result.objects.filter(survey=survey).count(), 3)
+        self.assertFalse(Attempt.objects.filter(finished_on__isnull=True).exists())
+
+
+class CloneSurveyTest(TestCase):
+
+    def contents(self, survey):
+        return [(question.question_name, [(choice.choice_value, choice.weight)
+                                          for choice in question.choice_set.order_by('id')])
+                for question in survey.question_set.order_by('id')]
+
+    def test_cloning_several_surveys_keeps_each_surveys_choices(self):
+        from assessment.cloning import clone_surveys
+        newer = create_survey('Newer', 2, choice_count=3)
+        newer.pub_date = datetime.datetime(2020, 1, 1)
+        newer.save()
+        older = create_survey('Older', 3, choice_count=2)
+        older.pub_date = datetime.datetime(2015, 1, 1)
+        older.save()
+        Choice.objects.filter(question__survey=older).update(weight=9)
+        copies = clone_surveys([(newer, 'Newer copy'), (older, 'Older copy')])
+        self.assertEqual([copy.name for copy in copies], ['Newer copy', 'Older copy'])
+        self.assertEqual(self.contents(copies[0]), self.contents(newer))
+        self.assertEqual(self.contents(copies[1]), self.contents(older))
+
+
+
+class SurveyDefinitionTest(TestCase):
+    definition = {
+        'name': 'Brand check', 'description': 'About %s', 'insertion': 'Acme',
+        'choices': [{'choice_value': '%s rocks', 'weight': 2}, {'choice_value': 'Meh', 'weight': 0}],
+        'questions': [
+            {'question': 'How is %s?', 'question_name': 'Q1', 'question_type': Question.MULTICHOICE},
+            {'question': 'And 100%% of %s?', 'question_name': 'Q2', 'question_type': Question.MULTICHOICE,
+             'page_number': 2, 'choices': [{'choice_value': 'Yes', 'weight': 1}, {'choice_value': 5, 'weight': 0}]},
+        ],
+    }
+
+    def questions(self, definition):
+        return [(question['question_name'], question['question'], question['page_number'],
+                 [(choice['choice_value'], choice['weight']) for choice in question['choices']])
+                for question in definition['questions']]
+
+    def test_round_trip_keeps_placeholders_and_shared_choices(self):
+        from assessment.survey_io import import_survey, export_survey, read_definition, write_definition
+        survey = import_survey(self.definition)
+        self.assertEqual(Question.objects.get(survey=survey, question_name='Q1').question, 'How is Acme?')
+        self.assertEqual(sorted(Choice.objects.filter(question__survey=survey, question__question_name='Q1')
+                                .values_list('choice_value', flat=True)), ['Acme rocks', 'Meh'])
+        exported = export_survey(survey)
+        self.assertEqual(exported['description'], 'About %s')
+        self.assertEqual(self.questions(exported), [
+            ('Q1', 'How is %s?', 1, [('%s rocks', 2), ('Meh', 0)]),
+            ('Q2', 'And 100%% of %s?', 2, [('Yes', 1), ('5', 0)]),
+        ])
+        exported['name'] = 'Brand check again'
+        copy = import_survey(read_definition(write_definition(exported, 'json'), 'json'))
+        self.assertEqual(self.questions(export_survey(copy)), self.questions(exported))
+        self.assertEqual(Question.objects.get(survey=copy, question_name='Q2').question, 'And 100% of Acme?')
+
+    def test_malformed_choice_is_a_format_error(self):
+        from assessment.survey_io import SurveyFormatError, import_survey
+        definition = {'name': 'Bad', 'questions': [{'question': 'Q', 'choices': [{'weight': 1}]}]}
+        with self.assertRaisesRegexp(SurveyFormatError, 'Question 1, choice 1: missing choice_value'):
+            import_survey(definition)
+        self.assertFalse(Survey.objects.filter(name='Bad').exists())
+
+    def test_import_command_reports_malformed_definition(self):
+        definition = {'name': 'Bad', 'choices': [{'choice_value': 'Yes', 'weight': 'high'}],
+                      'questions': [{'question': 'Q'}]}
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(definition, f)
+            f.flush()
+            with self.assertRaisesRegexp(CommandError, 'Choices, choice 1: weight must be a number'):
+                call_command('import_survey', f.name, stdout=StringIO())
+
+class DraftTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.survey = create_survey('Drafts', 2)
+        self.user = User.objects.create(username='candidate')
+        self.user.set_password('candidate')
+        self.user.save()
+        Available.objects.create(user=self.user, survey=self.survey, url='')
+        self.client.login(username='candidate', password='candidate')
+        self.compiled = get_compiled_survey(self.survey.id)
+        self.url = reverse('assessment:assessment_survey', args=(self.survey.slug,))
+
+    def answers(self):
+        return dict(Answer.objects.filter(result__user=self.user).values_list('question__question_name', 'answer'))
+
+    def test_overlapping_autosaves_keep_each_others_fields(self):
+        from assessment import drafts
+        first, second = [question.field_key for question in self.compiled.questions]
+        drafts.save_changes(self.user.id, self.survey.id, {})
+        load_entry = drafts.load_entry
+
+        def slow_load_entry(user_id, survey_id):
+            entry = load_entry(user_id, survey_id)
+            time.sleep(0.05)
+            return entry
+        drafts.load_entry = slow_load_entry
+        try:
+            threads = [threading.Thread(target=drafts.save_changes, args=(self.user.id, self.survey.id, changes))
+                       for changes in ({first: 'a'}, {second: 'b'})]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            drafts.load_entry = load_entry
+        self.assertEqual(drafts.get_draft(self.user.id, self.survey.id), {first: 'a', second: 'b'})
+
+    def test_autosaved_answers_are_submitted_with_the_final_post(self):
+        first, second = self.compiled.questions
+        response = self.client.post(reverse('assessment:assessment_autosave', args=(self.survey.slug,)),
+                                    {'_fields': [first.field_key], first.field_key: str(first.choices[1].id)})
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['saved'], 1)
+        response = self.client.post(self.url, {'page': '1', 'finish': 'Finish',
+                                               second.field_key: str(second.choices[2].id)})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.answers(), {'Q0': 'Choice 1', 'Q1': 'Choice 2'})
+
+    def test_an_autosave_landing_after_the_final_post_does_not_replace_it(self):
+        from assessment import views
+        first, second = self.compiled.questions
+        get_draft = views.get_draft
+
+        def stale_autosave_lands(user_id, survey_id):
+            save_changes(user_id, survey_id, {first.field_key: str(first.choices[0].id)})
+            return get_draft(user_id, survey_id)
+        views.get_draft = stale_autosave_lands
+        try:
+            response = self.client.post(self.url, {'page': '1', 'finish': 'Finish',
+                                                   first.field_key: str(first.choices[3].id),
+                                                   second.field_key: str(second.choices[2].id)})
+        finally:
+            views.get_draft = get_draft
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.answers(), {'Q0': 'Choice 3', 'Q1': 'Choice 2'})
+
+
+class SurveyCacheCommitTest(TransactionTestCase):
+
+    def test_survey_is_invalidated_again_after_the_request_commits(self):
+        from django.core.signals import request_finished
+        from django.db import transaction
+        from assessment import survey_cache
+        cache.clear()
+        survey = create_survey('Cached', 1)
+        stale = get_compiled_survey(survey.id)
+        with transaction.atomic():
+            Choice.objects.filter(question__survey=survey).update(weight=7)
+            Choice.objects.filter(question__survey=survey).first().save()
+            # a concurrent request compiles the rows as they were before the
+            # commit and caches them under the new version
+            version = survey_cache.get_survey_version(survey.id)
+            cache.set(survey_cache.SNAPSHOT_KEY % (survey.id, version), stale._replace(version=version))
+            survey_cache._local_surveys.clear()
+            self.assertEqual(get_compiled_survey(survey.id).questions[0].choices[0].weight, 0)
+        request_finished.send(sender=self.__class__)
+        self.assertEqual(get_compiled_survey(survey.id).questions[0].choices[0].weight, 7)
@@ -0,0 +1,74 @@
+"""
+Stateless magic-login tokens.
+
+A token is the signed (HMAC with SECRET_KEY) triple of user id, revocation
+epoch and expiry time, so it is verified without reading the database.
+Revoking a user's links bumps UserProfile.token_epoch; the epochs of all
+users who ever had their links revoked are kept as one small dict in the
+cache, loaded from the database only when the cache entry is missing.
+
+Links built from UserProfile.profile_token keep working while
+ASSESSMENT_ACCEPT_PROFILE_TOKENS is true; revoking a user's links also
+replaces that token.
+"""
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import F
+
+from assessment.models import UserProfile
+
+
+TOKEN_SALT = 'assessment.login'
+LOGIN_TOKEN_MAX_AGE = getattr(settings, 'ASSESSMENT_LOGIN_TOKEN_MAX_AGE', 60 * 60 * 24 * 30)
+REVOKED_KEY = 'assessment:revoked-token-epochs'
+
+
+def load_revoked_epochs():
+    epochs = dict(UserProfile.objects.filter(token_epoch__gt=0).values_list('user_id', 'token_epoch'))
+    cache.set(REVOKED_KEY, epochs, None)
+    return epochs
+
+
+def revoked_epochs():
+    """
+    user id -> current token epoch for every user whose links were revoked.
+    """
+    epochs = cache.get(REVOKED_KEY)
+    if epochs is None:
+        epochs = load_revoked_epochs()
+    return epochs
+
+
+def make_login_token(user_id, epoch=None, max_age=LOGIN_TOKEN_MAX_AGE):
+    if epoch is None:
+        epoch = revoked_epochs().get(user_id, 0)
+    return signing.dumps([user_id, epoch, int(time.time() + max_age)], salt=TOKEN_SALT)
+
+
+def verify_login_token(token):
+    """
+    Return the user id of a valid, unexpired, unrevoked token, else None.
+    """
+    try:
+        user_id, epoch, expires = signing.loads(token, salt=TOKEN_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    if expires < time.time():
+        return None
+    if epoch != revoked_epochs().get(user_id, 0):
+        return None
+    return user_id
+
+
+def revoke_login_tokens(user_id):
+    """
+    Invalidate every login token and profile token link issued to a user so
+    far.
+    """
+    UserProfile.objects.filter(user_id=user_id).update(token_epoch=F('token_epoch') + 1,
+                                                       profile_token=str(uuid4()))
+    load_revoked_epochs()
@@ -9,13 +9,19 @@ urlpatterns = patterns('',
     url(r'^logout/$', views.user_logout, name='assessment_logout'),
     url(r'^registration/$', views.user_registration, name='assessment_registration'),
     url(r'^users/$', views.user_list, name='assessment_users'),
+    url(r'^users/import/$', views.user_import, name='assessment_import'),
     url(r'^users/(\d+)$', views.user_results, name='assessment_results'),
     url(r'^users/delete/(\d+)$', views.user_delete, name='assessment_deleteuser'),
+    url(r'^users/revoke/(\d+)$', views.user_revoke_tokens, name='assessment_revoketokens'),
     url(r'^surveys/$', views.SurveyListView.as_view(), name='assessment_surveys'),
     url(r'^surveys/(?P<slug>[-\w]+)/$', views.ResultCreateView.as_view(), name='assessment_survey'),
+    url(r'^surveys/(?P<slug>[-\w]+)/autosave/$', views.survey_autosave, name='assessment_autosave'),
     url(r'^surveys/results/(?P<pk>\d+)/$', views.ResultDetailView.as_view(), name='survey_results'),
     url(r'^results/$', views.ResultListView.as_view(), name="result_list"),
     url(r'^results/(?P<slug>[-\w]+)/$', views.SurveyResultListView.as_view(), name="survey_result_list"),
+    url(r'^results/(?P<slug>[-\w]+)/export/$', views.result_export, name="survey_result_export"),
+    url(r'^results/(?P<slug>[-\w]+)/statistics/$', views.result_statistics, name="survey_result_statistics"),
     url(r'^user/(?P<pk>\d+)/results/$', views.UserResultListView.as_view(), name='user_results'),
+    url(r'^_perf/$', views.perf_summary, name='assessment_perf'),
     url(r'^authenticate/(?P<profile_token>.+)$', views.user_authenticate, name='assessment_authenticate'),
 )
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
 from assessment.models import UserProfile, Survey, Available, MAX_LENGTH
+from assessment.survey_cache import get_survey_catalog
 from django.contrib.auth.forms import UserCreationForm
 import random, string
 
@@ -10,6 +11,10 @@ class LoginForm(forms.Form):
     password = forms.CharField(widget=forms.PasswordInput())
 
 
+class CandidateImportForm(forms.Form):
+    candidates = forms.FileField(label='Candidates (CSV or JSON)')
+
+
 class UserForm(UserCreationForm):
     username = forms.EmailField(max_length=MAX_LENGTH, label='E-mail Address')
     password1 = forms.CharField(widget=forms.HiddenInput, max_length=128, required=False, label='Password')
@@ -59,11 +64,19 @@ class UserForm(UserCreationForm):
 
 
 class RegistrationForm(UserForm):
-    internal_surveys = Survey.objects.filter(external_survey_url__iexact='')
-    external_surveys = Survey.objects.exclude(external_survey_url__iexact='')
 
     def __init__(self, *args, **kwargs):   
         super(RegistrationForm, self).__init__(*args, **kwargs)
+        # survey fields come from the cached catalog so they are current and
+        # importing this module does not query the database.
+        self.catalog = get_survey_catalog()
+        self.fields['survey_list'] = forms.MultipleChoiceField(
+            widget=forms.CheckboxSelectMultiple, required=False,
+            choices=[(survey.id, survey.name) for survey in self.catalog if not survey.external_survey_url])
+        for survey in self.catalog:
+            if survey.external_survey_url:
+                self.fields[survey.name + '_url'] = forms.CharField(max_length=255, label=survey.name + " url",
+                                                                    required=False)
 
     username = forms.EmailField(max_length=MAX_LENGTH, label='E-mail Address')
     password1 = forms.CharField(max_length=128, required=True, label='Password')
@@ -75,10 +88,6 @@ class RegistrationForm(UserForm):
     )
 
     is_staff = forms.ChoiceField(widget=forms.RadioSelect, choices=staff_choices, initial='f', label='Admin')
-    survey_list = forms.ModelMultipleChoiceField(widget=forms.CheckboxSelectMultiple, queryset=internal_surveys, required=False)
-    for survey in external_surveys:
-        external_url = survey.name + '_url'
-        locals()[external_url] = forms.CharField(max_length=255, label=survey.name + " url", required=False)
     
     def save(self, commit=False):
         user = super(UserForm, self).save(commit=False)
@@ -110,15 +119,14 @@ class RegistrationForm(UserForm):
         profile.job_location = self.cleaned_data['job_location']
         profile.company = self.cleaned_data['company']
         profile.assessment_protocol = self.cleaned_data['assessment_protocol']
-        profile.profile_token = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(32))
         profile.save()
 
-        for survey in self.cleaned_data['survey_list']:
-            s = Available(user=user, survey=survey)
+        for survey_id in self.cleaned_data['survey_list']:
+            s = Available(user=user, survey_id=int(survey_id))
             s.save()
-        for survey in Survey.objects.exclude(external_survey_url__iexact=''):
+        for survey in self.catalog:
             external_url = survey.name + '_url'
-            if external_url in self.cleaned_data and self.cleaned_data[external_url] is not '':
-                s = Available(user=user, survey=survey, url=self.cleaned_data[external_url])
+            if survey.external_survey_url and self.cleaned_data.get(external_url):
+                s = Available(user=user, survey_id=survey.id, url=self.cleaned_data[external_url])
                 s.save()
         return user
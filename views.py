@@ -1,7 +1,11 @@
 import datetime
+import json
+
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404, render_to_response
 from django.template import RequestContext, loader
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (HttpResponse, HttpResponseRedirect, Http404, StreamingHttpResponse, HttpResponseForbidden,
+                         HttpResponseNotAllowed)
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django import forms
@@ -9,12 +13,30 @@ from django.views.generic import ListView, DetailView, CreateView, UpdateView
 from django.core.urlresolvers import reverse
 from django.forms.models import model_to_dict
 from django.contrib.sites.models import get_current_site
+from django.utils.dateparse import parse_date
+from django.db.models import Q
+from django.db import IntegrityError
 
 from braces.views import LoginRequiredMixin, SuperuserRequiredMixin
 
-from assessment.models import UserProfile, Survey, Question, Answer, Choice, Result
+from assessment.models import UserProfile, Survey, Question, Answer, Choice, Result, ItemAnalysis
 from assessment.user_forms import *
 from assessment.survey_forms import *
+from assessment.survey_cache import get_compiled_survey_by_slug
+from assessment.pagination import keyset_paginate
+from assessment.exports import LAYOUTS, FORMATS, CONTENT_TYPES, export_results
+from assessment.survey_stats import survey_statistics
+from assessment.auth import get_cached_user
+from assessment.drafts import get_draft, save_changes, discard_draft, draft_form_data
+from assessment.attempts import start_attempt
+from assessment.dashboard import get_dashboard
+from assessment.perf import perf_report
+from assessment.tokens import make_login_token, verify_login_token, revoke_login_tokens
+from assessment.candidates import (CandidateImportError, WEB_IMPORT_MAX_PASSWORDS, WEB_IMPORT_MAX_ROWS,
+                                   read_candidates, validate_candidates, web_import_errors, import_candidates,
+                                   write_login_urls)
+
+ACCEPT_PROFILE_TOKENS = getattr(settings, 'ASSESSMENT_ACCEPT_PROFILE_TOKENS', True)
 
 try:
     from django.contrib.auth import get_user_model
@@ -83,8 +105,7 @@ def user_registration(request):
             user = user_form.save(commit=False)
             password = user_form.cleaned_data['password1']
             user.set_password(password)
-            profile = UserProfile.objects.get(user=user)
-            login_url = ''.join(['http://', get_current_site(request).domain, reverse('assessment:assessment_authenticate', args=(profile.profile_token,))])
+            login_url = ''.join(['http://', get_current_site(request).domain, reverse('assessment:assessment_authenticate', args=(make_login_token(user.id, epoch=0),))])
             user.save()
             registered = True
             user_form = RegistrationForm()
@@ -101,15 +122,68 @@ def user_registration(request):
     return render_to_response(template, objects, context)
 
 
+def user_import(request):
+    if not request.user.is_authenticated():
+        return redirect('assessment:assessment_login')
+    if not request.user.is_staff:
+        return redirect('assessment:assessment_index')
+    errors = []
+    if request.method == 'POST':
+        import_form = CandidateImportForm(request.POST, request.FILES)
+        if import_form.is_valid():
+            upload = import_form.cleaned_data['candidates']
+            format = 'json' if upload.name.lower().endswith('.json') else 'csv'
+            try:
+                candidates = read_candidates(upload.read().decode('utf-8-sig'), format)
+                errors = web_import_errors(candidates) or validate_candidates(candidates)
+            except (CandidateImportError, UnicodeDecodeError) as e:
+                errors = [str(e)]
+            if not errors:
+                users = import_candidates(candidates)
+                response = HttpResponse(content_type='text/csv')
+                response['Content-Disposition'] = 'attachment; filename="login-urls.csv"'
+                write_login_urls(response, get_current_site(request).domain, users)
+                return response
+    else:
+        import_form = CandidateImportForm()
+    template = 'assessment/base_import.html'
+    referer = request.META.get('HTTP_REFERER')
+    objects = {'import_form': import_form, 'errors': errors, 'referrer': referer,
+               'max_passwords': WEB_IMPORT_MAX_PASSWORDS, 'max_rows': WEB_IMPORT_MAX_ROWS}
+    context = RequestContext(request)
+    return render_to_response(template, objects, context)
+
+
 def user_list(request):
     if not request.user.is_authenticated():
         return redirect('assessment:assessment_login')
     if not request.user.is_staff:
         return redirect('assessment:assessment_index')
-    users = User.objects.order_by('last_name').exclude(id=1)
+    profiles = UserProfile.objects.select_related('user').exclude(user_id=1)
+    search = request.GET.get('q', '').strip()
+    if search:
+        profiles = profiles.filter(
+            Q(user__last_name__istartswith=search) | Q(user__first_name__istartswith=search) |
+            Q(user__email__istartswith=search) | Q(company__istartswith=search) |
+            Q(job_department__istartswith=search) | Q(assessment_protocol__istartswith=search))
+    for field in ('company', 'job_department', 'assessment_protocol'):
+        value = request.GET.get(field, '').strip()
+        if value:
+            profiles = profiles.filter(**{field + '__istartswith': value})
+    page = keyset_paginate(profiles, ('user__last_name', 'user__id'), request.GET.get('cursor'),
+                           per_page=50, descending=False)
+    query = request.GET.copy()
+    first_url = next_url = None
+    if 'cursor' in query:
+        del query['cursor']
+        first_url = '?' + query.urlencode()
+    if page.has_next():
+        query['cursor'] = page.next_cursor
+        next_url = '?' + query.urlencode()
     template = 'assessment/base_users.html'
     referer = request.META.get('HTTP_REFERER')
-    objects = {'users': users, 'referrer': referer}
+    objects = {'profiles': page.object_list, 'filters': request.GET, 'first_url': first_url,
+               'next_url': next_url, 'referrer': referer}
     context = RequestContext(request)
     return render_to_response(template, objects, context)
 
@@ -181,30 +255,52 @@ def user_results(request, id):
     if request.user.is_staff:
         user_form.fields['password1'] = forms.CharField(max_length=128, required=False, label='Password')
         user_form.fields['password2'] = forms.CharField(max_length=128, required=False, label='Confirm Password')
-    login_url = ''.join(['http://', get_current_site(request).domain, reverse('assessment:assessment_authenticate', args=(profile.profile_token,))])
+    login_url = ''.join(['http://', get_current_site(request).domain, reverse('assessment:assessment_authenticate', args=(make_login_token(user.id),))])
     post_url = reverse('assessment:assessment_results', args=(id,))
     template = 'assessment/base_user.html'
     referer = reverse('assessment:assessment_landpage')
     surveys_next = False
+    previous = request.META.get('HTTP_REFERER', '')
     if request.user.is_staff or request.user.is_superuser:
-        referer = request.META.get('HTTP_REFERER')
-    if reverse('assessment:assessment_landpage') in request.META.get('HTTP_REFERER') or post_url in request.META.get('HTTP_REFERER'):
+        referer = previous
+    if reverse('assessment:assessment_landpage') in previous or post_url in previous:
         surveys_next = True
-    objects = {'userinfo': user, 'user_form': user_form, 'updated': updated, 'referrer': referer, 'post_url': post_url, 'login_url': login_url, 'surveys_next': surveys_next}
+    results = user.results.select_related('survey')
+    objects = {'userinfo': user, 'user_form': user_form, 'updated': updated, 'referrer': referer, 'post_url': post_url, 'login_url': login_url, 'surveys_next': surveys_next, 'results': results}
     context = RequestContext(request)
     return render_to_response(template, objects, context)
 
 
 def user_authenticate(request, profile_token):
-    profile = UserProfile.objects.filter(profile_token=profile_token)[0]
-    user = User.objects.filter(id=profile.user_id)[0]
-    user.backend='django.contrib.auth.backends.ModelBackend'
+    user_id = verify_login_token(profile_token)
+    if user_id is not None:
+        user = get_cached_user(user_id)
+        if user is None:
+            raise Http404
+    elif ACCEPT_PROFILE_TOKENS:
+        # links issued before signed tokens
+        user = get_object_or_404(UserProfile.objects.select_related('user'), profile_token=profile_token).user
+    else:
+        raise Http404
+    user.backend='assessment.auth.EmailOrUsernameModelBackend'
     login(request, user)
     if not user.is_staff:
         return redirect('assessment:assessment_landpage')
     return redirect('assessment:assessment_index')
 
 
+def user_revoke_tokens(request, id):
+    if not request.user.is_authenticated():
+        return redirect('assessment:assessment_login')
+    if not request.user.is_staff:
+        return redirect('assessment:assessment_index')
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    user = get_object_or_404(User, pk=id)
+    revoke_login_tokens(user.id)
+    return redirect('assessment:assessment_results', user.id)
+
+
 def user_delete(request, id):
     if not request.user.is_authenticated():
         return redirect('assessment:assessment_login')
@@ -221,38 +317,102 @@ def user_delete(request, id):
     return redirect('assessment:assessment_users')
 
 
+def result_export(request, slug):
+    if not request.user.is_authenticated():
+        return redirect('assessment:assessment_login')
+    if not request.user.is_staff:
+        return redirect('assessment:assessment_index')
+    try:
+        survey = get_compiled_survey_by_slug(slug)
+    except Survey.DoesNotExist:
+        raise Http404
+    layout = request.GET.get('layout', 'long')
+    format = request.GET.get('format', 'csv')
+    if layout not in LAYOUTS or format not in FORMATS:
+        raise Http404
+    response = StreamingHttpResponse(export_results(survey, layout, format), content_type=CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename="%s-%s.%s"' % (survey.slug, layout, format)
+    return response
+
+
+def result_statistics(request, slug):
+    if not request.user.is_authenticated():
+        return redirect('assessment:assessment_login')
+    if not request.user.is_staff:
+        return redirect('assessment:assessment_index')
+    survey = get_object_or_404(Survey, slug=slug)
+    statistics = survey_statistics(survey.id)
+    # refreshed by the sweep_attempts and item_analysis commands
+    analysis = ItemAnalysis.objects.filter(survey=survey).first()
+    statistics['alpha'] = analysis.alpha if analysis else None
+    if request.GET.get('format') == 'json':
+        return HttpResponse(json.dumps(statistics), content_type='application/json')
+    template = 'assessment/base_surveystatistics.html'
+    referer = request.META.get('HTTP_REFERER')
+    items = analysis.items.select_related('question') if analysis else []
+    objects = {'survey': survey, 'statistics': statistics, 'items': items, 'referrer': referer}
+    context = RequestContext(request)
+    return render_to_response(template, objects, context)
+
+
+def perf_summary(request):
+    if not request.user.is_authenticated():
+        return redirect('assessment:assessment_login')
+    if not request.user.is_staff:
+        return redirect('assessment:assessment_index')
+    report = perf_report()
+    if request.GET.get('format') == 'json':
+        return HttpResponse(json.dumps(report), content_type='application/json')
+    template = 'assessment/base_perf.html'
+    referer = request.META.get('HTTP_REFERER')
+    objects = {'report': report, 'referrer': referer}
+    context = RequestContext(request)
+    return render_to_response(template, objects, context)
+
+
 def landing_page(request):
     profile = reverse('assessment:assessment_results', args=(request.user.id,))
     template = 'assessment/base_landpage.html'
-    available_incomplete = Available.objects.filter(user_id=request.user.id)
-    surveys_available = []
-    for available in available_incomplete:
-        surveys_available.append(available.survey)
-    objects = {'profile': profile, 'assessments': surveys_available}
+    objects = {'profile': profile, 'assessments': get_dashboard(request.user.id).assigned}
     context = RequestContext(request)
     return render_to_response(template, objects, context)
 
 
+def survey_autosave(request, slug):
+    if not request.user.is_authenticated():
+        return HttpResponseForbidden()
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        survey = get_compiled_survey_by_slug(slug)
+    except Survey.DoesNotExist:
+        raise Http404
+    if not Available.objects.filter(user_id=request.user.id, survey_id=survey.id).exists():
+        return HttpResponseForbidden()
+    if Result.objects.filter(user_id=request.user.id, survey_id=survey.id).exists():
+        # an autosave that arrived after the survey was submitted
+        return HttpResponse(json.dumps({'saved': 0, 'flushed': False}), content_type='application/json')
+    keys = set(key for question in survey.questions for key in question.field_keys)
+    multiple = set(question.field_key for question in survey.questions if question.question_type == Question.MULTISELECT)
+    changes = {}
+    for key in request.POST.getlist('_fields'):
+        if key in multiple:
+            changes[key] = request.POST.getlist(key)
+        elif key in keys:
+            changes[key] = request.POST.get(key, '')
+    flushed = save_changes(request.user.id, survey.id, changes, flush='_flush' in request.POST)
+    return HttpResponse(json.dumps({'saved': len(changes), 'flushed': flushed}), content_type='application/json')
+
+
 class SurveyListView(LoginRequiredMixin, ListView):
     template_name = 'assessment/base_surveylist.html'
     model = Survey
 
     def get_context_data(self, **kwargs):
-        results = self.request.user.results.all()
-        results = Result.objects.filter(user_id=self.request.user.id)
-        results_surveys = []
-        for result in results:
-            results_surveys.append(result.survey)
-        available_incomplete = Available.objects.filter(
-            user_id=self.request.user.id).exclude(
-                survey__in=results_surveys
-        )
-        surveys_available = []
-        for available in available_incomplete:
-            surveys_available.append(available.survey)
+        dashboard = get_dashboard(self.request.user.id)
         context = super(SurveyListView, self).get_context_data(**kwargs)
-        context['incomplete_available'] = reversed(surveys_available)
-        context['user_results'] = results
+        context['incomplete_available'] = dashboard.pending
+        context['user_results'] = dashboard.completed
         context['referrer'] = self.request.META.get('HTTP_REFERER')
         return context
 
@@ -260,18 +420,66 @@ class SurveyListView(LoginRequiredMixin, ListView):
         return Survey.objects.order_by('pub_date')
 
 
-class UserResultListView(LoginRequiredMixin, ListView):
+class KeysetResultListMixin(object):
+    """
+    Newest-first keyset pagination over results, with survey, user and date
+    range filters taken from the query string.
+    """
+    page_size = 50
+    ordering_keys = ('completed_on', 'id')
+
+    def get_result_queryset(self):
+        queryset = Result.objects.select_related('user', 'survey')
+        survey = self.request.GET.get('survey')
+        if survey:
+            queryset = queryset.filter(survey__slug=survey)
+        user = self.request.GET.get('user', '')
+        if user.isdigit():
+            queryset = queryset.filter(user_id=user)
+        try:
+            date_from = parse_date(self.request.GET.get('from', ''))
+            date_to = parse_date(self.request.GET.get('to', ''))
+        except ValueError:
+            date_from = date_to = None
+        if date_from:
+            queryset = queryset.filter(completed_on__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(completed_on__lt=date_to + datetime.timedelta(days=1))
+        return queryset
+
+    def get_queryset(self):
+        self.page = keyset_paginate(self.get_result_queryset(), self.ordering_keys,
+                                    self.request.GET.get('cursor'), self.page_size)
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super(KeysetResultListMixin, self).get_context_data(**kwargs)
+        query = self.request.GET.copy()
+        if 'cursor' in query:
+            del query['cursor']
+            context['first_url'] = '?' + query.urlencode()
+        if self.page.has_next():
+            query['cursor'] = self.page.next_cursor
+            context['next_url'] = '?' + query.urlencode()
+        context['results'] = self.object_list
+        context['filters'] = self.request.GET
+        return context
+
+
+class UserResultListView(LoginRequiredMixin, KeysetResultListMixin, ListView):
     model = Result
     template_name = 'assessment/base_userresults.html'
 
+    def get_result_queryset(self):
+        return super(UserResultListView, self).get_result_queryset().filter(user=self.kwargs['pk'])
+
     def get_context_data(self, **kwargs):
         context = super(UserResultListView, self).get_context_data(**kwargs)
-        context['results'] = Result.objects.filter(user=self.kwargs['pk'])
         context['referrer'] = self.request.META.get('HTTP_REFERER')
         return context
 
 
-class ResultListView(LoginRequiredMixin, SuperuserRequiredMixin, ListView):
+class ResultListView(LoginRequiredMixin, SuperuserRequiredMixin, KeysetResultListMixin, ListView):
     model = Result
     template_name = 'assessment/base_resultlist.html'
 
@@ -287,14 +495,15 @@ class ResultListView(LoginRequiredMixin, SuperuserRequiredMixin, ListView):
             return redirect('assessment:assessment_surveys')
 
 
-class SurveyResultListView(LoginRequiredMixin, ListView):
+class SurveyResultListView(LoginRequiredMixin, KeysetResultListMixin, ListView):
     model = Result
     template_name = 'assessment/base_surveyresultlist.html'
 
+    def get_result_queryset(self):
+        return super(SurveyResultListView, self).get_result_queryset().filter(survey__slug=self.kwargs['slug'])
+
     def get_context_data(self, **kwargs):
         context = super(SurveyResultListView, self).get_context_data(**kwargs)
-        context['results'] = Result.objects.filter(
-                survey__in=Survey.objects.filter(slug=self.kwargs['slug']))
         context['referrer'] = self.request.META.get('HTTP_REFERER')
         return context
 
@@ -303,9 +512,18 @@ class ResultDetailView(LoginRequiredMixin, DetailView):
     model = Result
     template_name = 'assessment/base_surveyresult.html'
 
+    def get_queryset(self):
+        return Result.objects.select_related('survey', 'user')
+
     def get_context_data(self, **kwargs):
         context = super(ResultDetailView, self).get_context_data(**kwargs)
         context['referrer'] = reverse('assessment:assessment_surveys')
+        if self.object.snapshot:
+            context['answers'] = self.object.get_snapshot()
+        else:
+            # not backfilled yet
+            context['answers'] = [{'question': answer.question.question, 'answer': answer.answer, 'score': None}
+                                  for answer in self.object.answers.select_related('question')]
         return context
 
     def get(self, request, *args, **kwargs):
@@ -322,48 +540,118 @@ class ResultCreateView(LoginRequiredMixin, CreateView):
     template_name = 'assessment/base_survey.html'
     form_class = ResultCreateForm
 
+    def get_survey(self):
+        if not hasattr(self, 'survey'):
+            try:
+                self.survey = get_compiled_survey_by_slug(self.kwargs['slug'])
+            except Survey.DoesNotExist:
+                raise Http404
+        return self.survey
+
+    def get_attempt(self):
+        if not hasattr(self, 'attempt'):
+            self.attempt = start_attempt(self.request.user, self.get_survey(), self.request.session)
+        return self.attempt
+
+    def get_page_number(self):
+        """
+        The page being shown or submitted; the first page when missing or
+        unknown.
+        """
+        pages = self.get_survey().page_numbers
+        try:
+            page_number = int(self.request.POST.get('page') or self.request.GET.get('page') or pages[0])
+        except ValueError:
+            return pages[0]
+        return page_number if page_number in pages else pages[0]
+
     def get_form_kwargs(self):
-        survey = Survey.objects.get(slug=self.kwargs['slug'])
-        if survey.slug not in self.request.session:
-            self.request.session[survey.slug] = str(datetime.datetime.now())
+        survey = self.get_survey()
         kwargs = super(ResultCreateView, self).get_form_kwargs()
         kwargs['survey'] = survey
         kwargs['user'] = self.request.user
-        kwargs['started_on'] = self.request.session[survey.slug]
+        kwargs['started_on'] = self.get_attempt().started_on
+        kwargs['page_number'] = self.get_page_number()
+        if 'data' in kwargs:
+            # autosaved answers fill in whatever the POST left out
+            kwargs['data'] = draft_form_data(get_draft(self.request.user.id, survey.id), kwargs['data'])
         return kwargs
 
+    def get_initial(self):
+        return get_draft(self.request.user.id, self.get_survey().id)
+
     def get_context_data(self, **kwargs):
         context = super(ResultCreateView, self).get_context_data(**kwargs)
-        survey = Survey.objects.get(slug=self.kwargs['slug'])
+        survey = self.get_survey()
         available = Available.objects.get(user_id=self.request.user.id, survey_id=survey.id)
         external_url = available.url
-        user = self.request.user
-        started_on = self.request.session[survey.slug]
-        delta = datetime.datetime.strptime(str(datetime.datetime.now()), "%Y-%m-%d %H:%M:%S.%f") - datetime.datetime.strptime(started_on, "%Y-%m-%d %H:%M:%S.%f")
-        delta = delta.days * 86400 + delta.seconds
-        answer_form = ResultCreateForm(survey, user, started_on)
-        zipped = zip(answer_form, survey.question_set.all())
-        context['survey_form'] = zipped
+        pages = survey.page_numbers
+        page_number = context['form'].page_number
         context['referrer'] = self.request.META.get('HTTP_REFERER')
-        context['survey'] = Survey.objects.get(slug=self.kwargs['slug'])
-        context['seconds_allowed'] = survey.minutes_allowed * 60 - delta
+        context['survey'] = survey
+        context['seconds_allowed'] = self.get_attempt().remaining_seconds() or 0
         context['external_url'] = external_url
+        if page_number is not None:
+            index = pages.index(page_number)
+            context['page_number'] = page_number
+            context['page_count'] = len(pages)
+            context['previous_page'] = pages[index - 1] if index > 0 else None
+            context['next_page'] = pages[index + 1] if index + 1 < len(pages) else None
         return context
 
     def get(self, request, *args, **kwargs):
-        survey = Survey.objects.get(slug=self.kwargs['slug'])
+        survey = self.get_survey()
         
         if Result.objects.filter(
-            survey=survey,
+            survey_id=survey.id,
             user=self.request.user).exists():
             return redirect('assessment:assessment_surveys')
         if not Available.objects.filter(user_id=self.request.user.id, survey_id=survey.id).count():
             return redirect('assessment:assessment_surveys')
         return super(ResultCreateView, self).get(request, *args, **kwargs)
 
+    def form_valid(self, form):
+        try:
+            response = super(ResultCreateView, self).form_valid(form)
+        except IntegrityError:
+            # a concurrent submission of the same survey got there first.
+            return redirect('assessment:assessment_surveys')
+        discard_draft(self.request.user.id, self.get_survey().id)
+        return response
+
     def post(self, request, *args, **kwargs):
+        survey = self.get_survey()
         if Result.objects.filter(
-            survey=Survey.objects.get(slug=self.kwargs['slug']),
+            survey_id=survey.id,
             user=self.request.user).exists():
             return redirect('assessment:assessment_surveys')
-        return super(ResultCreateView, self).post(request, *args, **kwargs)
\ No newline at end of file
+        if not Available.objects.filter(user_id=self.request.user.id, survey_id=survey.id).exists():
+            return redirect('assessment:assessment_surveys')
+        self.object = None
+        form = self.get_form(self.get_form_class())
+        pages = survey.page_numbers
+        index = pages.index(form.page_number)
+        if 'previous' in request.POST:
+            # going back keeps whatever was entered, valid or not.
+            save_changes(request.user.id, survey.id, form.page_data(), flush=True)
+            return self.page_redirect(pages[max(index - 1, 0)])
+        if not form.is_valid():
+            return self.form_invalid(form)
+        page = form.page_data()
+        save_changes(request.user.id, survey.id, page, flush=True)
+        if 'finish' not in request.POST and index + 1 < len(pages):
+            return self.page_redirect(pages[index + 1])
+        # every page is in the draft now; validate and submit the whole survey.
+        # The posted values win over an autosave that landed after them, and
+        # over the draft when the whole survey was shown after failing this.
+        draft = get_draft(request.user.id, survey.id)
+        draft.update(page)
+        form = self.form_class(survey, request.user, self.get_attempt().started_on,
+                               data=draft_form_data(draft, request.POST))
+        if form.is_valid():
+            return self.form_valid(form)
+        return self.form_invalid(form)
+
+    def page_redirect(self, page_number):
+        return HttpResponseRedirect('%s?page=%s' % (reverse('assessment:assessment_survey',
+                                                            kwargs={'slug': self.get_survey().slug}), page_number))